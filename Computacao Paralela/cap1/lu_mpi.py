@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Distributed LU factorization and solve of a dense n x n system.
+#
+# The columns of the matrix are dealt to the ranks in blocks of
+# `block_size`, cyclically (block K lives on rank K % size), so each
+# rank only ever holds n*n/size numbers (plus one panel).
+# For each block of columns, its owner factors it (partial pivoting)
+# and broadcasts the pivots and the factored panel with buffer based
+# collectives (comm.Bcast); every rank then swaps its own lines and
+# updates its own columns with one matrix product.
+#
+# Run with a size (a random, normally distributed test matrix, which
+# needs pivoting) or an .npy file, and optionally the block size:
+#   mpirun -n 4 python3 lu_mpi.py 10000 64
+#   mpirun -n 4 python3 lu_mpi.py matrix.npy
+# It prints the timings, the number of swapped lines and the residual.
+#
+# Strong scaling:
+#   for k in 1 2 4 8; do mpirun -n $k python3 lu_mpi.py 10000; done
+# Measured so far only on a single core machine, where more ranks just
+# share that core, so this is not a scaling result:
+#   ranks=1 n=10000 block=64: factor 56.1s, solve 0.24s, residual 3.9E-11
+#   ranks=2 n=10000 block=64: factor 51.4s, solve 0.22s, residual 3.9E-11
+# Correctness was checked with 1 to 4 ranks (n=1000, block 32).
+
+from mpi4py import MPI
+import numpy as np
+
+def local_blocks(n, block_size, rank, size):
+    """Global column blocks (as (start, end)) held by `rank`, in order."""
+    return tuple(
+        (k0, min(k0 + block_size, n))
+        for k0 in range(rank*block_size, n, size*block_size))
+
+def local_columns(n, block_size, rank, size):
+    """Global indices of the columns held by `rank`."""
+    blocks = local_blocks(n, block_size, rank, size)
+    return np.concatenate([np.arange(k0, k1) for k0, k1 in blocks] or [np.zeros(0, int)])
+
+def load_local(filename, block_size, comm=MPI.COMM_WORLD):
+    """Reads this rank's columns of the square matrix in an .npy file.
+
+    The file is memory-mapped, so only those columns are read.
+    """
+    matrix = np.load(filename, mmap_mode='r')
+    columns = local_columns(matrix.shape[0], block_size, comm.Get_rank(), comm.Get_size())
+    return np.array(matrix[:, columns], float)
+
+class DistributedLU:
+    """LU factorization (partial pivoting) of a column block-cyclic matrix.
+
+    `local` are this rank's columns (see `local_columns`); they are
+    overwritten by the factors, L (unit diagonal) below the diagonal
+    and U above. As in Folha7Ex2.LUFactorization,
+        A[perm] = L @ U
+    and `perm` is known to every rank.
+    """
+    def __init__(self, local, n, block_size, comm=MPI.COMM_WORLD):
+        self.comm = comm
+        self.rank, self.size = comm.Get_rank(), comm.Get_size()
+        self.n, self.block_size = n, block_size
+        self.local = local
+        self.blocks = local_blocks(n, block_size, self.rank, self.size)
+        self.perm = np.arange(n)
+        # Local column where each global block starts
+        self.offsets = {}
+        offset = 0
+        for k0, k1 in self.blocks:
+            self.offsets[k0] = offset
+            offset += k1 - k0
+
+        for K, k0 in enumerate(range(0, n, block_size)):
+            k1 = min(k0 + block_size, n)
+            width = k1 - k0
+            owner = K % self.size
+            pivots = np.empty(width, np.int64)
+            panel = np.empty((n - k0, width))
+            if self.rank == owner:
+                c0 = self.offsets[k0]
+                self._factor_panel(local[k0:, c0:c0 + width], k0, pivots)
+                panel[:] = local[k0:, c0:c0 + width]
+            comm.Bcast(pivots, root=owner)
+            comm.Bcast(panel, root=owner)
+            # Same line swaps, on all the other columns
+            for j, pivot in zip(range(k0, k1), pivots):
+                if pivot != j:
+                    self.perm[[j, pivot]] = self.perm[[pivot, j]]
+                    if self.rank == owner:
+                        c0 = self.offsets[k0]
+                        local[[j, pivot], :c0] = local[[pivot, j], :c0]
+                        local[[j, pivot], c0 + width:] = local[[pivot, j], c0 + width:]
+                    else:
+                        local[[j, pivot]] = local[[pivot, j]]
+            # Columns right of the panel: lines k0:k1 of U, then the trailing update
+            trailing = sum(kk1 - kk0 for kk0, kk1 in self.blocks if kk0 < k1)
+            if trailing == local.shape[1]:
+                continue
+            right = local[:, trailing:]
+            for i in range(1, width):
+                right[k0 + i] -= panel[i, :i] @ right[k0:k0 + i]
+            right[k1:] -= panel[width:] @ right[k0:k1]
+
+    @staticmethod
+    def _factor_panel(panel, k0, pivots):
+        """Unblocked LU with partial pivoting of panel (lines k0: of the matrix)."""
+        width = panel.shape[1]
+        for j in range(width):
+            pivot = j + np.argmax(np.abs(panel[j:, j]))
+            pivots[j] = k0 + pivot
+            if pivot != j:
+                panel[[j, pivot]] = panel[[pivot, j]]
+            if panel[j, j] == 0:
+                continue
+            panel[j+1:, j] /= panel[j, j]
+            panel[j+1:, j+1:] -= np.outer(panel[j+1:, j], panel[j, j+1:])
+
+    def solve(self, b):
+        """Solves  Ax = b; b (a vector) and x are replicated on every rank."""
+        x = np.array(b, float)[self.perm]
+        n, block_size, local = self.n, self.block_size, self.local
+        starts = tuple(range(0, n, block_size))
+        # Forward substitution, by blocks of L
+        for K, k0 in enumerate(starts):
+            k1 = min(k0 + block_size, n)
+            owner = K % self.size
+            if self.rank == owner:
+                block = local[:, self.offsets[k0]:self.offsets[k0] + k1 - k0]
+                for i in range(k0 + 1, k1):
+                    x[i] -= block[i, :i - k0] @ x[k0:i]
+                x[k1:] -= block[k1:] @ x[k0:k1]
+            self.comm.Bcast(x[k0:], root=owner)
+        # Back substitution, by blocks of U
+        for K in range(len(starts) - 1, -1, -1):
+            k0 = starts[K]
+            k1 = min(k0 + block_size, n)
+            owner = K % self.size
+            if self.rank == owner:
+                block = local[:, self.offsets[k0]:self.offsets[k0] + k1 - k0]
+                for i in range(k1 - 1, k0 - 1, -1):
+                    x[i] = (x[i] - block[i, i - k0 + 1:] @ x[i+1:k1])/block[i, i - k0]
+                x[:k0] -= block[:k0] @ x[k0:k1]
+            self.comm.Bcast(x[:k1], root=owner)
+        return x
+
+def test_columns(n, block_size, rank, size, seed=0):
+    """This rank's columns of a random (standard normal) test matrix.
+
+    Not diagonally dominant, so factoring it needs line swaps.
+    """
+    blocks = []
+    for k0, k1 in local_blocks(n, block_size, rank, size):
+        blocks.append(np.random.default_rng((seed, k0)).standard_normal((n, k1 - k0)))
+    return np.concatenate(blocks, axis=1) if blocks else np.zeros((n, 0))
+
+if __name__ == '__main__':
+    import sys
+
+    # Either a matrix size (a random test matrix) or an .npy file
+    argument = sys.argv[1] if len(sys.argv) > 1 else '2000'
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+
+    if argument.endswith('.npy'):
+        original = lambda: load_local(argument, block_size, comm)
+    else:
+        original = lambda: test_columns(int(argument), block_size, rank, size)
+    local = original()
+    n = local.shape[0]
+    b = np.ones(n)
+
+    comm.Barrier()
+    start = MPI.Wtime()
+    factorization = DistributedLU(local, n, block_size, comm)
+    comm.Barrier()
+    factored = MPI.Wtime()
+    x = factorization.solve(b)
+    solved = MPI.Wtime()
+
+    # Residual, reloading the columns
+    columns = local_columns(n, block_size, rank, size)
+    partial = original() @ x[columns]
+    Ax = np.empty(n)
+    comm.Allreduce(partial, Ax, op=MPI.SUM)
+
+    if rank == 0:
+        print('ranks={} n={} block={}: factor {:.3f}s, solve {:.3f}s, {} lines swapped, residual {:.2E}'.format(
+            size, n, block_size, factored - start, solved - factored,
+            np.count_nonzero(factorization.perm != np.arange(n)), np.max(np.abs(Ax - b))))
@@ -1,12 +1,13 @@
 # -*- coding:utf-8 -*-
 
+import io
 import urllib.request as urlreq
 import numpy as np
 import matplotlib.pyplot as plt
 from functools import reduce
 
-from Folha9Ex1 import min_sqrs
-from Folha8Ex1 import ErrorValue
+from least_squares import design_matrix, linear_regression, t_critical
+from matrix_io import read_text_matrix
 
 # URL of data file
 URL = "http://www.cadc-ccda.hia-iha.nrc-cnrc.gc.ca/COURTEAU/catalogue/courteau99.dat"
@@ -19,7 +20,7 @@ def get_r_sqrd (x_points : np.array, y_points : np.array):
     n = len(x_points)
     Sx = np.sum(x_points)
     Sy = np.sum(y_points)
-    Sxy = sum(x_points[i]*y_points[i] for i in range(n))
+    Sxy = x_points @ y_points
     Sx2 = np.sum(x_points**2)
     Sy2 = np.sum(y_points**2)
     return (n*Sxy-Sx*Sy)**2/(n*Sx2-Sx**2)/(n*Sy2-Sy**2)
@@ -28,28 +29,22 @@ if __name__ == '__main__':
 
     assert(len(CORRELATE_VARS) == 2)
 
-    x_points = []
-    y_points = []
-    
     with urlreq.urlopen(URL) as http_req:
+        file = io.TextIOWrapper(http_req, 'UTF-8')
         # Find index of vars to correlate
-        labels = next(http_req).decode('UTF-8').split()
-        x_index, y_index = (labels.index(var) for var in CORRELATE_VARS) 
-        
+        labels = file.readline().split()
+        x_index, y_index = (labels.index(var) for var in CORRELATE_VARS)
+
         # Skip indexes
-        next(http_req)
-
-        # Read to end and grab x,y points
-        for line in http_req:
-            line = line.split()
-            x_points.append(float(line[x_index]))
-            y_points.append(float(line[y_index]))
-    
-    x_points = np.array(x_points)
-    y_points = np.array(y_points)
+        file.readline()
+
+        # Read to end and grab x,y points (only these two columns are converted)
+        x_points, y_points = read_text_matrix(file, usecols=(x_index, y_index)).T
+
     n = len(x_points)
 
-    b,a = min_sqrs(x_points, y_points, 1)
+    regression = linear_regression(design_matrix(x_points), y_points)
+    b,a = regression.solve()
     approx_x = np.arange(min(x_points), max(x_points))
     approx_y = a*approx_x + b
 
@@ -61,8 +56,8 @@ if __name__ == '__main__':
     print('Relation coefficient:')
     print(r)
 
-    # @ 95% confidence, t_c = 2.365
-    tc = 2.365
+    # @ 95% confidence (two sided), n - 2 degrees of freedom
+    tc = t_critical(0.95, n - 2)
     t = np.sqrt(r2*(n- 2)/(1 - r2)) # Actually abs of t
 
     print('T-Test absolute value:')
@@ -70,10 +65,9 @@ if __name__ == '__main__':
 
     print('With 95% certainty, there is{} correlation between the given variables.'.format('n\'t sufficient evidence of' if t < tc else ''))
 
-    x_avg = np.average(x_points)
-    delta = tc * np.sqrt(sum((a*x_points[i] + b - y_points[i])**2 for i in range(n))/sum(x_points[i]**2 - n*x_avg for i in range(n))/(n-2))
-
-    a_with_err = ErrorValue(a, delta)
+    # Half width of the 95% interval,  tc * sqrt(rss/(n - 2)/Sxx), with
+    #  Sxx = sum((x - x_avg)^2) (it used to be sum(x^2) - n*x_avg, wrongly)
+    b_with_err, a_with_err = regression.error_values(0.95)
     print('With 95% certainty, the linear relation of the data has slope:')
     print(a_with_err)
 
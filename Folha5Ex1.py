@@ -2,6 +2,8 @@
 
 from itertools import chain
 from functools import reduce
+import numpy as np
+from proxy_io import register_proxy, save_proxy
 
 def prod (of):
     return reduce(lambda a,b: a*b, of)
@@ -18,6 +20,102 @@ def get_lagrange_interpolate (data):
 
     return lambda x: sum(data[i][1] * get_L(i)(x) for i in range(len(data)))
 
+@register_proxy
+class NewtonInterpolation:
+    """Newton form of the interpolating polynomial of (x,y) data.
+
+    The divided differences are kept so that a new point can be
+    appended in O(n), without redoing the interpolation:
+        p(x) = coefs[0] + (x - x_0)*(coefs[1] + (x - x_1)*(coefs[2] + ...))
+    Can be called with a number or an array of x values.
+    """
+    def __init__(self, data=()):
+        self.n = 0 # Number of points
+        self._x = np.zeros(8)
+        self._coefs = np.zeros(8)
+        # Last row of the divided difference table,
+        #  f[x_n-1], f[x_n-2, x_n-1], ..., f[x_0, ..., x_n-1]
+        self._row = np.zeros(8)
+        self.extend(data)
+
+    @property
+    def x(self):
+        return self._x[:self.n]
+
+    @property
+    def coefs(self):
+        return self._coefs[:self.n]
+
+    def _grow(self):
+        size = 2*len(self._x)
+        for name in ('_x', '_coefs', '_row'):
+            grown = np.zeros(size)
+            grown[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, grown)
+
+    def append(self, x, y):
+        """Adds the point (x,y) to the interpolation, in O(n)."""
+        n = self.n
+        # Checked before touching the table, so a rejected point changes nothing
+        if np.any(self.x == x):
+            raise ValueError('Repeated x value: {}'.format(x))
+        if n == len(self._x):
+            self._grow()
+        row, xs = self._row, self._x
+        # New row computed in place; row[k-1] is still the old value
+        #  when computing row[k], so go through it keeping the previous one.
+        prev, row[0] = row[0], y
+        for k in range(1, n + 1):
+            prev, row[k] = row[k], (row[k-1] - prev)/(x - xs[n-k])
+        xs[n] = x
+        self._coefs[n] = row[n]
+        self.n += 1
+
+    def extend(self, data):
+        for x, y in data:
+            self.append(x, y)
+
+    def __call__(self, x):
+        # Nested multiplication
+        x = np.asarray(x, float)
+        result = np.full(x.shape, self._coefs[self.n - 1])
+        for k in range(self.n - 2, -1, -1):
+            result *= x - self._x[k]
+            result += self._coefs[k]
+        return result[()] # Unwrap scalars
+
+    def error_estimate(self, x):
+        """Estimates the interpolation error at x.
+
+        As in Neville's algorithm, this is the difference between the
+        interpolations with and without the last point added,
+        |f[x_0, ..., x_n] * (x - x_0) * ... * (x - x_n-1)|.
+        """
+        x = np.asarray(x, float)
+        result = np.full(x.shape, abs(self._coefs[self.n - 1]))
+        for k in range(self.n - 1):
+            result *= np.abs(x - self._x[k])
+        return result[()]
+
+    def proxy_arrays(self):
+        return {'x': self.x, 'coefs': self.coefs, 'row': self._row[:self.n]}
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        interpolation = cls()
+        n = len(arrays['x'])
+        while len(interpolation._x) < n:
+            interpolation._grow()
+        interpolation._x[:n] = arrays['x']
+        interpolation._coefs[:n] = arrays['coefs']
+        interpolation._row[:n] = arrays['row']
+        interpolation.n = n
+        return interpolation
+
+    def save(self, filename):
+        """Saves the interpolation; reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
+
 if __name__ == '__main__':
 
     import matplotlib.pyplot as plt
@@ -23,6 +23,7 @@ if __name__ == '__main__':
     import matplotlib.pyplot as plt
     import numpy as np
     from math import pi
+    from Folha5Ex1 import NewtonInterpolation
 
     data = (
         (1920,    106.46),
@@ -54,6 +55,15 @@ Predicted population in 2000: {}
 Actual population in 2000: {}
 '''.format(interpolation(2000), data[-1]))
 
+    # Newton form: adding the 2000 point does not redo the interpolation
+    newton = NewtonInterpolation(data[:-1])
+    print('''
+Newton form prediction for 2000: {} (estimated error {})
+'''.format(newton(2000), newton.error_estimate(2000)))
+    newton.append(*data[-1])
+    print('''Newton form at 1995, with 2000 included: {}
+'''.format(newton(1995)))
+
     print('''\
 One can see that, while the interpolation is very good at including the
 considered points, it is not adequate to extrapolate the data.
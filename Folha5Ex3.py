@@ -1,47 +1,58 @@
 # -*- coding: utf-8 -*-
 
-from math import inf
+import numpy as np
+from proxy_io import register_proxy, save_proxy
+from banded import thomas
+
+@register_proxy
+class SplineInterpolation:
+    """Cubic spline returned by `get_spline_interpolation`.
+
+    Piece k is
+        c1[k] + t*(c2[k] + t*(c3[k] + t*c4[k])),   t = x - knots[k]
+    The first piece extends down to -inf and the last one used
+    (second to last interval) up to +inf.
+    Can be called with a number or an array of x values.
+    """
+    def __init__(self, knots, c1, c2, c3, c4):
+        self.knots = knots
+        self.c1, self.c2, self.c3, self.c4 = c1, c2, c3, c4
+        # Piece k is used for breaks[k-1] <= x < breaks[k]
+        self.breaks = knots[1:-2]
+
+    def __call__(self, x):
+        x = np.asarray(x, float)
+        k = np.searchsorted(self.breaks, x, side='right')
+        t = x - self.knots[k]
+        result = self.c1[k] + t*(self.c2[k] + t*(self.c3[k] + t*self.c4[k]))
+        return result[()] # Unwrap scalars
+
+    def proxy_arrays(self):
+        return {'knots': self.knots, 'c1': self.c1, 'c2': self.c2, 'c3': self.c3, 'c4': self.c4}
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        return cls(**arrays)
+
+    def save(self, filename):
+        """Saves the spline; reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
 
 def get_spline_interpolation (data):
     # Find coefficients
-    n = len(data) - 1
-    c1 = []
-    c2 = []
-    c3 = []
-    c4 = []
-    h = []
-    z = []
-    d = [None] # 1-indexed
-    b = [None] # 1-indexed
-    m = [0 for i in range(n + 1)]
-    for i in range(0, n):
-        h.append(data[i+1][0] - data[i][0])
-        z.append((data[i+1][1] - data[i][1])/h[i])
-    d.append(2*(h[0] + h[1]))
-    b.append(6*(z[1] - z[0]))
-    for i in range(2, n):
-        M = h[i-1]/d[i-1]
-        d.append(2*(h[i-1]+h[i]) - M*h[i-1])
-        b.append(6*(z[i] - z[i-1]) - M*b[i-1])
-    m[n-1] = b[n-1]/d[n-1]
-    for i in range(n-2, 0, -1):
-        m[i] = (b[i] - h[i] * m[i+1])/d[i]
-    for i in range(0, n):
-        c1.append(data[i][1])
-        c2.append(z[i]-h[i]/6*(m[i+1] + 2*m[i]))
-        c3.append(m[i]/2)
-        c4.append((m[i+1]-m[i])/(6*h[i]))
+    data = np.asarray(data, float)
+    knots, y = data[:,0], data[:,1]
+    h = np.diff(knots)
+    z = np.diff(y)/h
+    # Natural spline: m[0] = m[n] = 0, and the inner m solve a tridiagonal system
+    m = np.zeros(len(knots))
+    m[1:-1] = thomas(h[:-1], 2*(h[:-1] + h[1:]), h[1:], 6*np.diff(z))
+    c1 = y[:-1]
+    c2 = z - h/6*(m[1:] + 2*m[:-1])
+    c3 = m[:-1]/2
+    c4 = (m[1:] - m[:-1])/(6*h)
     # Return function
-    segments = tuple([data[x][0], data[x+1][0]] for x in range(n - 1))
-    segments[0][0] = -inf
-    segments[-1][1] = +inf
-    def interpolated(x):
-        for i in range(len(segments)):
-            k = i
-            if x >= segments[i][0] and x < segments[i][1]:
-                break
-        return c1[k] + (x - data[k][0]) * (c2[k] + (x - data[k][0]) * (c3[k] + (x - data[k][0])*c4[k]))
-    return interpolated
+    return SplineInterpolation(knots, c1, c2, c3, c4)
 
 if __name__ == '__main__':
 
@@ -65,9 +76,7 @@ if __name__ == '__main__':
 
     xrange = np.arange(1900, 2010, 0.01)
     
-    interpolation_y = tuple(
-        interpolation(x) for x in xrange
-    )
+    interpolation_y = interpolation(xrange)
     plt.plot(xrange, interpolation_y, label='Spline interpolation.')
     plt.plot(tuple(x[0] for x in data), tuple(x[1] for x in data), 'o', label='Data (1920 - 1990)')
     plt.legend(loc='best')
@@ -3,156 +3,120 @@
 from math import inf
 import numpy as np
 from functools import reduce
+from Folha7Ex2 import LUFactorization
 
 def gauss_elimination (extended_matrix):
     """Triangularize an extended matrix.
 
-    This assumes the matrix is represented as
-        a list of np arrays, in the format
-        of list of lines.
-    This is not especially optimized.
+    The matrix is a 2D array (or anything `np.asarray` takes,
+        e.g. a list of lines), n by n + 1.
+    Arrays are triangularized in place; each step updates
+        every line below the pivot at once (no pivoting).
     Returns triangularized matrix.
     """
-    v_length, h_length = len(extended_matrix), len(extended_matrix[0])
+    extended_matrix = np.asarray(extended_matrix, float)
+    v_length, h_length = extended_matrix.shape
     if abs(v_length - h_length) != 1:
         raise ValueError('Cannot triangularize a non square coefficient matrix.')
     for j in range(0, v_length - 1):
-        for i in range(j + 1, v_length):
-            extended_matrix[i] = extended_matrix[i] - extended_matrix[j]/extended_matrix[j][j]*extended_matrix[i][j]
+        multipliers = extended_matrix[j+1:, j]/extended_matrix[j, j]
+        extended_matrix[j+1:] -= np.outer(multipliers, extended_matrix[j])
     return extended_matrix
 
 def make_extended_matrix (A, b):
     """Given a coefficient matrix A and result vector b, returns an extended matrix.
 
-    This assumes the matrix is represented as
-        a list of np arrays, in the format
-        of list of lines.
-    This is not especially optimized.
+    The result is a new n by n + 1 array, [A|b]; see
+        `split_extended_matrix` for views of its parts.
     """
-    extended_matrix = make_matrix(len(A[0]) + 1, len(A))
-    for j in range(len(extended_matrix)):
-        for i in range(len(extended_matrix[j]) - 1):
-            extended_matrix[j][i] = A[j][i]
-        extended_matrix[j][-1] = b[j]
+    A = np.asarray(A, float)
+    extended_matrix = np.empty((A.shape[0], A.shape[1] + 1))
+    extended_matrix[:, :-1] = A
+    extended_matrix[:, -1] = np.ravel(b)
     return extended_matrix
 
+def split_extended_matrix (extended_matrix):
+    """Returns (A, b), views (no copies) of an extended matrix [A|b]."""
+    extended_matrix = np.asarray(extended_matrix)
+    return extended_matrix[:, :-1], extended_matrix[:, -1]
+
 def get_solution (triangularized_matrix):
     """Returns the vector of solutions given a triangularized extended matrix.
 
-    This assumes the matrix is represented as
-        a list of np arrays, in the format
-        of list of lines.
+    The solution is a column, n by 1.
     If the matrix is not yet triangularized,
-        call `gauss_elimination` first. 
-    This is not especially optimized.
+        call `gauss_elimination` first.
     """
+    triangularized_matrix = np.asarray(triangularized_matrix, float)
     v_length = len(triangularized_matrix)
-    solutions = make_matrix(1,v_length)
+    solutions = make_matrix(1, v_length)
     for j in range(v_length - 1, -1, -1):
-        others = sum(triangularized_matrix[j][u] * solutions[u][0] for u in range(j + 1, v_length))
-        solutions[j][0] = (triangularized_matrix[j][-1] - others)/triangularized_matrix[j][j]
+        others = triangularized_matrix[j, j+1:v_length] @ solutions[j+1:, 0]
+        solutions[j, 0] = (triangularized_matrix[j, -1] - others)/triangularized_matrix[j, j]
     return solutions
 
 def get_inverse (matrix):
     """Determines inverse matrix of given matrix.
 
-    This assumes the matrix is represented as
-        a list of np arrays, in the format
-        of list of lines.
-    This is not especially optimized.
+    The matrix is LU factored once and every column of the
+        inverse is then found by triangular substitution.
     """
-    # Get basis of matrix
-    dim = len(matrix[0])
-    basis = []
-    for i in range(dim):
-        basis.append(as_vector(
-            (0,)*i + (1,) + (0,)*(dim - i - 1)
-        ))
-    # Solve for each vector
-    sol = [
-        get_solution(gauss_elimination(make_extended_matrix(matrix, versor)))
-        for versor in basis
-    ]
-    # "Make" inverse
-    result = make_matrix(len(basis), dim)
-    for j in range(dim):
-        for i in range(len(basis)):
-            result[j][i] = sol[i][j]
-    return result
+    return LUFactorization(matrix).inverse()
 
 def make_matrix (n, m):
     """Make a horizontal n by vertical m zero matrix."""
-    matrix = []
-    for _ in range(m):
-        matrix.append(np.zeros(n))
-    return matrix
+    return np.zeros((m, n))
 
 def as_matrix (obj):
-    h_size = len(obj[0]) if hasattr(obj[0], '__len__') else 1
-    v_size = len(obj) if hasattr(obj, '__len__') else 1
-    matrix = make_matrix(h_size, v_size)
-    if v_size > 1:
-        for i in range(v_size):
-            if h_size > 1:
-                for j in range(h_size):
-                    matrix[i][j] = obj[i][j]
-            else:
-                matrix[i] = obj[i]
-    else:
-        matrix[0][0] = obj
+    """2D array from nested sequences; vectors become columns, scalars 1 by 1."""
+    matrix = np.array(obj, float)
+    if matrix.ndim < 2:
+        matrix = matrix.reshape(-1, 1)
     return matrix
 
 def as_vector (vector):
-    v_size = len(vector) if hasattr(vector, '__len__') else 1
-    matrix = make_matrix(1, v_size)
-    if v_size > 1:
-        for i in range(v_size):
-            matrix[i][0] = vector[i]
-    else:
-        matrix[0][0] = vector
-    return matrix
+    """Column (n by 1) array from a vector or a scalar."""
+    return np.array(vector, float).reshape(-1, 1)
 
 def pprint_matrix(matrix):
     return 'MATRIX:\n\t' + '\n\t'.join('\t'.join(str(matrix[i][j]) for j in range(len(matrix[i]))) for i in range(len(matrix)))
 
 def matrix_mult (A, B):
     """ Returns the matricial product of A,B """
-    result = make_matrix(len(B[0]), len(A))
-    for j in range(len(result)):
-        for i in range(len(result[0])):
-            result[j][i] = np.sum(A[j] * np.asarray(tuple(B[u][i] for u in range(len(B)))))
-    return result
+    return np.asarray(A, float) @ np.asarray(B, float)
 
 def get_identity(n):
     """Returns an nxn identity matrix."""
-    matrix = make_matrix(n,n)
-    for i in range(n):
-        matrix[i][i] = 1
-    return matrix
+    return np.eye(n)
+
+def compare_matrices(A, B, rtol : float = 1e-9, atol : float = 1e-12):
+    """Whether A and B have the same shape and entries, up to the tolerances.
 
-def compare_matrices(A,B):
-    A_v_length, A_h_length = len(A), len(A[0])
-    B_v_length, B_h_length = len(B), len(B[0])
-    if A_v_length != B_v_length or A_h_length != B_h_length:
-        return False
-    return all(all(A[j] == B[j]) for j in range(len(A)))
+    Entries match if |a - b| <= atol + rtol*|b|; rtol = atol = 0
+        asks for exact equality.
+    """
+    A, B = np.asarray(A), np.asarray(B)
+    return A.shape == B.shape and bool(np.allclose(A, B, rtol=rtol, atol=atol))
 
 if __name__ == '__main__':
 
     import argparse
     import sys
+    from matrix_io import read_system, load_matrix
 
     parser = argparse.ArgumentParser(description='Solves a linear eq. system.')
-    parser.add_argument('file', nargs='?', help='File with matrix data (stdin by default)',
-        type=argparse.FileType('r'), default=sys.stdin)
+    parser.add_argument('file', nargs='?', default='-',
+        help='File with matrix data (stdin by default): text, b on the first line and then A, '
+             'or an .npy file with the extended matrix [A|b]')
     args = parser.parse_args()
 
-    with args.file as infile:
-        b = infile.readline().split()
-        A = tuple(x.split() for x in infile.read().split('\n'))
+    if args.file.endswith('.npy'):
+        A, b = split_extended_matrix(load_matrix(args.file))
+    else:
+        A, b = read_system(sys.stdin if args.file == '-' else args.file)
 
-    coef_matrix = as_matrix(A)
-    result_vec = as_vector(b)
+    coef_matrix = A
+    result_vec = b
     extended_matrix = make_extended_matrix(coef_matrix, result_vec)
     
     print('EXTENDED MATRIX')
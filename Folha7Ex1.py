@@ -1,5 +1,7 @@
 # -*- coding:utf-8 -*-
 
+from fractions import Fraction
+from math import lcm
 import numpy as np
 
 def print_privoted (matrix, pivot_table):
@@ -8,48 +10,126 @@ def print_privoted (matrix, pivot_table):
     print( '\n'.join('\t'.join(str(matrix[pivot_table[u],w]) for w in range(a_y)) for u in range(a_x)) )
     print('---')
 
-def solve(A : np.matrix, b : np.matrix):
+def solve(A : np.matrix, b : np.matrix, exact : bool = False):
     """Solve matrix equation system  Ax = b  for x.
     
     This assumes A and b are given in np.matrix form.
+    b may have several columns, which are solved for together.
     This returns an np.matrix.
+    With `exact`, see `exact_solve`: the result is an array of Fractions.
     """
+    if exact:
+        return exact_solve(A, b)[0]
     # Use floats
     A = A.astype(float)
     b = b.astype(float)
     # Horizontal (i index) and vertical (j index) size
     a_x, a_y = A.shape
-    # Pivoted to "true" matrix horizontal index
-    #  initialized to i->i (identity)
-    pivot_table = np.arange(0, a_y, 1)
-    # Get extended matrix
-    extended_matrix = np.concatenate((A, b), axis=1)
+    # Get extended matrix (plain ndarray, so rows slice as vectors)
+    extended_matrix = np.concatenate((np.asarray(A), np.asarray(b)), axis=1)
     # Triangularization:
     for j in range(0, a_x-1):
-        # Consider partial pivot
-        pivot = max(range(j, a_y), key=lambda i: np.abs(extended_matrix[pivot_table[i],j]))
-        prev = pivot_table[j]
-        pivot_table[j] = pivot_table[pivot]
-        pivot_table[pivot] = prev
-        # Eliminate
-        for i in range(j+1, a_y):
-            np.add(
-                extended_matrix[pivot_table[i],:],
-                -extended_matrix[pivot_table[j],:]/extended_matrix[pivot_table[j],j]*extended_matrix[pivot_table[i],j],
-                out=extended_matrix[pivot_table[i],:]
-            )
+        # Consider partial pivot, swapping the lines themselves
+        pivot = j + np.argmax(np.abs(extended_matrix[j:,j]))
+        if pivot != j:
+            extended_matrix[[j, pivot],:] = extended_matrix[[pivot, j],:]
+        # Eliminate every line below at once (rank 1 update)
+        coefs = extended_matrix[j+1:,j]/extended_matrix[j,j]
+        extended_matrix[j+1:,j:] -= np.outer(coefs, extended_matrix[j,j:])
 
     # Retro elimination
-    # at this point, the *swapped* matrix is diagonal
     # Note that only lines were swapped, so the result
-    #  vector does not need to reference pivot_table
-    result = np.zeros((a_x, 1))
+    #  vector is already in the right order
+    result = np.zeros((a_x, extended_matrix.shape[1] - a_x))
     for i in range(a_y-1, -1, -1):
         result[i] = (
-            extended_matrix[pivot_table[i],-1] - sum(extended_matrix[pivot_table[i],j]*result[j] for j in range(i+1,a_x))
-        )/extended_matrix[pivot_table[i],i]
+            extended_matrix[i,a_x:] - extended_matrix[i,i+1:a_x] @ result[i+1:]
+        )/extended_matrix[i,i]
     return result
 
+def _integer_lines(matrix):
+    """Object array of ints, each line scaled by the lcm of its denominators.
+
+    Returns (lines, scales); the entries may be ints, Fractions or
+    floats (taken at their exact binary value).
+    """
+    matrix = np.asarray(matrix)
+    lines = np.empty(matrix.shape, dtype=object)
+    scales = []
+    for i, line in enumerate(matrix):
+        line = [Fraction(x) for x in line]
+        scale = lcm(*(x.denominator for x in line))
+        lines[i] = [int(x.numerator)*int(scale//x.denominator) for x in line]
+        scales.append(int(scale))
+    return lines, scales
+
+def _bareiss(M, n):
+    """Fraction-free (Bareiss) elimination of the first n columns of M, in place.
+
+    M is an object array of ints; after step k every entry
+    M[i, j] (i, j > k) is a (k + 1) x (k + 1) minor of the input, so
+    integers stay as small as the determinant itself and every
+    division is exact. Returns the sign of the line swaps, or 0 if
+    the first n columns are singular.
+    """
+    sign = 1
+    previous = 1
+    for k in range(n):
+        if M[k, k] == 0:
+            nonzero = np.flatnonzero(M[k+1:, k] != 0)
+            if len(nonzero) == 0:
+                return 0
+            pivot = k + 1 + nonzero[0]
+            M[[k, pivot]] = M[[pivot, k]]
+            sign = -sign
+        rest = M[k+1:, k+1:]
+        rest[...] = (M[k, k]*rest - np.outer(M[k+1:, k], M[k, k+1:]))//previous
+        M[k+1:, k] = 0
+        previous = M[k, k]
+    return sign
+
+def exact_determinant(A):
+    """Exact determinant of an integer or rational matrix, by Bareiss elimination.
+
+    Returns an int for integer matrices, otherwise a Fraction.
+    """
+    M, scales = _integer_lines(A)
+    n = len(M)
+    if n == 0:
+        return 1
+    sign = _bareiss(M, n)
+    det = Fraction(sign*M[n-1, n-1], np.prod(scales, dtype=object))
+    return det.numerator if det.denominator == 1 else det
+
+def exact_solve(A, b):
+    """Solve  Ax = b  exactly, for integer or rational A and b.
+
+    Uses fraction-free (Bareiss) elimination, so the work is done on
+    integers no larger than the minors of [A|b], instead of on
+    Fractions whose sizes blow up. By Cramer's rule  det*x  is an
+    integer vector, which the back substitution finds with exact
+    integer divisions.
+    Returns (x, det): x is an object array of Fractions, shaped as b
+    (a vector or a block of columns), and det = det(A).
+    """
+    A = np.asarray(A)
+    b = np.asarray(b)
+    n = len(A)
+    columns = b.reshape(n, -1)
+    M, scales = _integer_lines(np.concatenate((A.astype(object), columns.astype(object)), axis=1))
+    sign = _bareiss(M, n)
+    if sign == 0:
+        raise ValueError('Singular matrix.')
+    U, c = M[:, :n], M[:, n:]
+    det = U[n-1, n-1] # Of the scaled A
+    # y = det*x solves  U y = det*c
+    y = np.empty(c.shape, dtype=object)
+    for i in range(n - 1, -1, -1):
+        y[i] = (det*c[i] - U[i, i+1:] @ y[i+1:])//U[i, i]
+    x = np.array([[Fraction(value, det) for value in line] for line in y], dtype=object)
+    det = Fraction(sign*det, np.prod(scales, dtype=object))
+    return x.reshape(b.shape), (det.numerator if det.denominator == 1 else det)
+
 if __name__ == '__main__':
     SQRT2 = np.sqrt(2)
     A = np.matrix((
@@ -63,4 +143,17 @@ if __name__ == '__main__':
         (1,)
     ))
     result = solve(A,b)
-    print(result)
\ No newline at end of file
+    print(result)
+
+    import time
+    from matrix_io import read_system
+    A, b = read_system('Folha6Ex1Test.txt')
+    x, det = exact_solve(A.astype(int), b.astype(int))
+    print('Folha6Ex1Test.txt, exact: x = ({}), det = {}'.format(', '.join(map(str, x)), det))
+
+    n = 200
+    A = np.random.default_rng(0).integers(0, 2, (n, n))
+    start = time.perf_counter()
+    det = exact_determinant(A)
+    print('Exact determinant of a random {}x{} 0/1 matrix: {} digits, {:.3f}s'.format(
+        n, n, len(str(abs(det))), time.perf_counter() - start))
\ No newline at end of file
@@ -2,53 +2,396 @@
 
 import numpy as np
 
+class Permutation:
+    """Permutation of the lines of a matrix, kept as an index array.
+
+    As a matrix, P[i, perm[i]] = 1 (see `asmatrix`), so
+        P @ M == M[perm]
+    which costs O(n) per column instead of a dense product.
+    """
+    # Make numpy defer `M @ P` to __rmatmul__
+    __array_ufunc__ = None
+
+    def __init__(self, perm):
+        self.perm = np.asarray(perm)
+
+    def __len__(self):
+        return len(self.perm)
+
+    def apply(self, matrix):
+        """Returns P @ matrix."""
+        return np.asarray(matrix)[self.perm]
+
+    def inverse(self):
+        inverse = np.empty_like(self.perm)
+        inverse[self.perm] = np.arange(len(self.perm))
+        return Permutation(inverse)
+
+    T = property(inverse) # Permutation matrices are orthogonal
+
+    @property
+    def sign(self):
+        """Parity, +1 or -1: the determinant of the permutation matrix."""
+        # (-1)^(n - number of cycles)
+        visited = np.zeros(len(self.perm), bool)
+        perm = self.perm.tolist()
+        cycles = 0
+        for start in range(len(perm)):
+            if not visited[start]:
+                cycles += 1
+                i = start
+                while not visited[i]:
+                    visited[i] = True
+                    i = perm[i]
+        return -1 if (len(perm) - cycles) % 2 else 1
+
+    def asmatrix(self):
+        matrix = np.zeros((len(self.perm), len(self.perm)), int)
+        matrix[np.arange(len(self.perm)), self.perm] = 1
+        return np.matrix(matrix)
+
+    def __matmul__(self, other):
+        if isinstance(other, Permutation):
+            return Permutation(other.perm[self.perm])
+        return self.apply(other)
+
+    def __rmatmul__(self, other):
+        # Permutes columns: (M @ P)[:, perm[i]] == M[:, i]
+        return np.asarray(other)[:, self.inverse().perm]
+
+    def __str__(self):
+        return str(self.asmatrix())
+
+    def __repr__(self):
+        return 'Permutation({})'.format(self.perm.tolist())
+
 def get_permutation (pivot_table):
-    return np.matrix(
-        tuple(
-            tuple((0,)*pivot_table[i] + (1,) + (0,)*(len(pivot_table)-pivot_table[i]-1))
-        for i in range(len(pivot_table))
-        )
-    )
-
-def LU (matrix : np.matrix):
+    """Dense permutation matrix of a pivot table (or a `Permutation`);
+    prefer `Permutation` for computations."""
+    if isinstance(pivot_table, Permutation):
+        return pivot_table.asmatrix()
+    return Permutation(pivot_table).asmatrix()
+
+def LU (matrix : np.matrix, permutation : bool = False):
     """Returns the (L, U, pivot_table) decomposition of given matrix.
 
-    Partial pivoting can be used.
-    This expects an np.matrix and returns a tuple
-    (L, U, pivot_table):"""
-    # Dimensions
-    dim_x, dim_y = matrix.shape
-    if dim_x != dim_y:
-        raise ValueError("Cannot LU non square matrix!")
-    # i->i (identity) pivot_table
-    pivot_table = np.arange(0, dim_y, 1)
-
-    L = np.zeros((dim_x, dim_y), float)
-    U = matrix # Not using copy for perf. and because arg should be ref anyway...
-    L, U = L.astype(float), U.astype(float) # Avoid troublesome casts
-
-    # Triangularization
-    for j in range(dim_x-1):
-        # Consider partial pivot
-        pivot = max(range(j, dim_y), key=lambda i: np.abs(U[pivot_table[i],j]))
-        prev = pivot_table[j]
-        pivot_table[j] = pivot_table[pivot]
-        pivot_table[pivot] = prev
-        # Eliminate and store coefficients
-        for i in range(j+1, dim_y):
-            coef = U[pivot_table[i],j]/U[pivot_table[j],j]
-            L[i, pivot_table[j]] = coef
-            U[pivot_table[i],:] -= U[pivot_table[j],:]*coef
- 
-    # L starts as an identity matrix but has its columns
-    #  shifted around; so we only set the "diagonal" to 1
-    #  at the end.
-    L[np.arange(dim_x), pivot_table] = 1.0
-
-    # Done
-    return (L, U, pivot_table)
+    Partial pivoting is used, and with P = get_permutation(pivot_table)
+        matrix == P @ L @ U
+    With `permutation`, the third item is P as a `Permutation` instead
+    of the pivot table. The matrix is not modified.
+    See `LUFactorization` to solve systems with the result."""
+    factorization = LUFactorization(matrix)
+    P = factorization.permutation.T
+    return (factorization.L, factorization.U, P if permutation else P.perm)
+
+class LUFactorization:
+    """LU decomposition with partial pivoting, computed once.
+
+    The rows of the matrix are swapped as needed, so that
+        matrix[perm] = L @ U
+    with L unit lower triangular and U upper triangular,
+    both packed in `lu`. The input matrix is not modified.
+    Once factored, each right hand side costs O(n^2).
+
+    The factorization is blocked: each panel of `block_size` columns
+    is factored on its own and the rest of the matrix is then updated
+    with a single matrix product (where BLAS does the heavy lifting).
+    `dtype` sets the precision the factors are computed and kept in.
+    """
+    def __init__(self, matrix, block_size : int = 64, dtype=float):
+        lu = np.array(matrix, dtype) # Copy, as plain ndarray
+        dim_x, dim_y = lu.shape
+        if dim_x != dim_y:
+            raise ValueError("Cannot LU non square matrix!")
+        perm = np.arange(dim_x)
+        for k0 in range(0, dim_x, block_size):
+            k1 = min(k0 + block_size, dim_x)
+            # Factor panel lu[k0:, k0:k1]
+            for j in range(k0, k1):
+                # Partial pivot; whole lines are swapped
+                pivot = j + np.argmax(np.abs(lu[j:, j]))
+                if pivot != j:
+                    lu[[j, pivot]] = lu[[pivot, j]]
+                    perm[[j, pivot]] = perm[[pivot, j]]
+                if lu[j, j] == 0:
+                    continue # Singular; nothing left to eliminate in this column
+                # Store coefficients and eliminate (within the panel)
+                lu[j+1:, j] /= lu[j, j]
+                lu[j+1:, j+1:k1] -= np.outer(lu[j+1:, j], lu[j, j+1:k1])
+            if k1 == dim_x:
+                break
+            # Lines k0:k1 of U, right of the panel
+            for i in range(k0 + 1, k1):
+                lu[i, k1:] -= lu[i, k0:i] @ lu[k0:i, k1:]
+            # Trailing submatrix update
+            lu[k1:, k1:] -= lu[k1:, k0:k1] @ lu[k0:k1, k1:]
+        self.n = dim_x
+        self.lu = lu
+        self.perm = perm
+        self._slogdet = None # Cached (sign, logabsdet)
+        # 1-norm of the matrix, for the condition estimate
+        self.norm1 = np.max(np.sum(np.abs(np.asarray(matrix, float)), axis=0)) if dim_x else 0.0
+
+    @property
+    def permutation(self):
+        """The `Permutation` P with P @ matrix == L @ U."""
+        return Permutation(self.perm)
+
+    @property
+    def L(self):
+        return np.tril(self.lu, -1) + np.identity(self.n)
+
+    @property
+    def U(self):
+        return np.triu(self.lu)
+
+    def slogdet(self):
+        """Returns (sign, log|det A|), from the U diagonal and the parity of perm.
+
+        Only sums logarithms, so it does not overflow for large
+        matrices; a singular matrix gives (0, -inf). O(n), and cached.
+        """
+        if self._slogdet is None:
+            diagonal = np.diagonal(self.lu).astype(float)
+            if np.any(diagonal == 0):
+                self._slogdet = (0.0, -np.inf)
+            else:
+                sign = self.permutation.sign*(-1)**np.count_nonzero(diagonal < 0)
+                self._slogdet = (float(sign), float(np.sum(np.log(np.abs(diagonal)))))
+        return self._slogdet
+
+    @property
+    def sign(self):
+        """Sign of the determinant (0 if singular)."""
+        return self.slogdet()[0]
+
+    @property
+    def logabsdet(self):
+        """log|det A|, overflow safe (see `slogdet`)."""
+        return self.slogdet()[1]
+
+    @property
+    def determinant(self):
+        """det A; may overflow to +-inf for large matrices, where `logabsdet` does not."""
+        sign, logabsdet = self.slogdet()
+        with np.errstate(over='ignore'):
+            return sign*np.exp(logabsdet)
+
+    def solve(self, b, transpose : bool = False):
+        """Solves  Ax = b  (or  A^T x = b)  for x.
+
+        b may be a single vector, shape (n,), or a block of
+        right hand sides, shape (n, m), solved together.
+        The work is done in the precision of the factors.
+        """
+        lu = self.lu
+        if transpose:
+            # A^T = U^T L^T P
+            x = np.array(b, lu.dtype)
+            for i in range(self.n):
+                x[i] = (x[i] - lu[:i, i] @ x[:i])/lu[i, i]
+            for i in range(self.n - 2, -1, -1):
+                x[i] -= lu[i+1:, i] @ x[i+1:]
+            return self.permutation.T.apply(x)
+        x = self.permutation.apply(np.array(b, lu.dtype))
+        # Forward substitution (L has unit diagonal)
+        for i in range(1, self.n):
+            x[i] -= lu[i, :i] @ x[:i]
+        # Back substitution
+        for i in range(self.n - 1, -1, -1):
+            x[i] = (x[i] - lu[i, i+1:] @ x[i+1:])/lu[i, i]
+        return x
+
+    def update(self, u, v):
+        """Updates the factors in place to those of  A + u v^T,  in O(n^2).
+
+        E.g. u = delta*e_i, v = e_j changes the entry (i, j) by delta;
+        u = e_i changes line i by v. There is no new pivoting, so this
+        fails (ValueError) if a pivot becomes zero and loses accuracy if
+        they become small; `woodbury` is the safer alternative.
+        """
+        lu = self.lu
+        # P (A + u v^T) = L U + (P u) v^T
+        x = self.permutation.apply(np.array(u, lu.dtype))
+        y = np.array(v, lu.dtype)
+        if len(x) != self.n or len(y) != self.n:
+            raise ValueError('Mismatched update vectors size.')
+        self._slogdet = None
+        self.norm1 += np.sum(np.abs(x))*np.max(np.abs(y)) # (now an upper bound)
+        for i in range(self.n):
+            pivot = lu[i, i] + x[i]*y[i]
+            if pivot == 0:
+                raise ValueError('Zero pivot in LU update; factor the matrix again.')
+            c, e = lu[i, i]/pivot, y[i]/pivot
+            l, u_line = lu[i+1:, i].copy(), lu[i, i+1:].copy()
+            lu[i, i] = pivot
+            # Line i of U and column i of L
+            lu[i, i+1:] += x[i]*y[i+1:]
+            lu[i+1:, i] = c*l + e*x[i+1:]
+            # What is left is a rank 1 update of the trailing factors
+            x[i+1:] -= x[i]*l
+            y[i+1:] = c*y[i+1:] - e*u_line
+
+    def downdate(self, u, v):
+        """Updates the factors in place to those of  A - u v^T  (see `update`)."""
+        self.update(-np.asarray(u, float), v)
+
+    def woodbury(self, U, V):
+        """Returns a `WoodburyUpdate`, which solves with  A + U V^T."""
+        return WoodburyUpdate(self, U, V)
+
+    def condition_estimate(self, iterations : int = 5):
+        """Estimates the 1-norm condition number ||A|| ||A^-1||.
+
+        ||A^-1|| is estimated with Hager's method, from a few
+        solves with A and A^T, at O(n^2) cost.
+        """
+        if self.n == 0:
+            return 0.0
+        x = np.full(self.n, 1/self.n)
+        estimate = 0.0
+        for _ in range(iterations):
+            y = self.solve(x).astype(float)
+            estimate = np.sum(np.abs(y))
+            z = self.solve(np.where(y >= 0, 1.0, -1.0), transpose=True).astype(float)
+            j = np.argmax(np.abs(z))
+            if not np.isfinite(estimate) or np.abs(z[j]) <= z @ x:
+                break
+            x = np.zeros(self.n)
+            x[j] = 1
+        return self.norm1*estimate
+
+    def inverse(self):
+        return self.solve(np.identity(self.n))
+
+class WoodburyUpdate:
+    """Solves with  A + U V^T,  given the LUFactorization of A.
+
+    U and V are n x k (or vectors, k = 1). By the Sherman-Morrison-Woodbury
+    formula,
+        (A + U V^T)^-1 b = y - Z (I + V^T Z)^-1 V^T y,    y = A^-1 b,  Z = A^-1 U
+    Z and the k x k matrix (I + V^T Z) are computed once, in O(k n^2);
+    each solve is then O(n^2 + k n), and A's factors are not touched.
+    """
+    def __init__(self, factorization : LUFactorization, U, V):
+        U = np.asarray(U, float)
+        V = np.asarray(V, float)
+        if U.ndim == 1:
+            U, V = U[:, None], V[:, None]
+        self.factorization = factorization
+        self.Z = factorization.solve(U)
+        self.V = V
+        self.capacitance = LUFactorization(np.identity(U.shape[1]) + V.T @ self.Z)
+
+    def solve(self, b):
+        y = self.factorization.solve(b)
+        return y - self.Z @ self.capacitance.solve(self.V.T @ y)
+
+def refined_solve(A, b, max_steps : int = 10):
+    """Solves  Ax = b  in double precision, factoring in single precision.
+
+    The float32 factorization (half the memory traffic) gives a first
+    solution, which is then corrected with float64 residuals,
+        x <- x + A^-1 (b - A x)
+    reusing the same factors. If the corrections stop shrinking (A
+    too badly conditioned for float32), A is factored again in float64.
+
+    Returns (x, info), where info holds the number of refinement
+    `steps`, the `condition` estimate and whether the float64
+    `fallback` was needed.
+    """
+    A = np.asarray(A, float)
+    b = np.asarray(b, float)
+    factorization = LUFactorization(A, dtype=np.float32)
+    condition = factorization.condition_estimate()
+    steps = 0
+    # Refinement only contracts when cond(A) * eps_32 < 1
+    fallback = not condition*np.finfo(np.float32).eps < 0.5
+    if not fallback:
+        x = factorization.solve(b).astype(float)
+        # Converged once the residual is at float64 rounding level
+        tolerance = np.sqrt(len(A))*np.finfo(float).eps*np.max(np.sum(np.abs(A), axis=1))
+        previous = np.inf
+        while True:
+            if steps == max_steps or not np.all(np.isfinite(x)):
+                fallback = True
+                break
+            r = b - A @ x
+            scale = np.max(np.abs(r))
+            if scale <= tolerance*np.max(np.abs(x)):
+                break
+            # Scaled, so the residual does not underflow in float32
+            dx = factorization.solve(r/scale).astype(float)*scale
+            x += dx
+            steps += 1
+            correction = np.max(np.abs(dx))
+            if correction > previous/2:
+                fallback = True # Stagnated
+                break
+            previous = correction
+    if fallback:
+        factorization = LUFactorization(A)
+        condition = factorization.condition_estimate()
+        x = factorization.solve(b)
+    return x, {'steps': steps, 'condition': float(condition), 'fallback': fallback}
+
+class BatchedLUFactorization:
+    """LU decompositions of a stack of k independent n x n matrices.
+
+    Same layout as `LUFactorization`, one per system:
+        matrices[s][perm[s]] = L[s] @ U[s]
+    Each system gets its own pivots, but every elimination step
+    runs over the whole stack at once, so the Python overhead is
+    paid once per column rather than once per system.
+    """
+    def __init__(self, matrices):
+        lu = np.array(matrices, float) # Copy
+        if lu.ndim != 3 or lu.shape[1] != lu.shape[2]:
+            raise ValueError("Expected a (k, n, n) stack of square matrices!")
+        k, n, _ = lu.shape
+        systems = np.arange(k)
+        perm = np.tile(np.arange(n), (k, 1))
+        for j in range(n - 1):
+            # Partial pivot of each system; whole lines are swapped
+            pivot = j + np.argmax(np.abs(lu[:, j:, j]), axis=1)
+            lu[systems, j], lu[systems, pivot] = lu[systems, pivot], lu[systems, j]
+            perm[systems, j], perm[systems, pivot] = perm[systems, pivot], perm[systems, j]
+            # A zero pivot means the column below is zero too (singular system)
+            pivots = lu[:, j, j]
+            pivots = np.where(pivots == 0, 1, pivots)
+            # Store coefficients and eliminate
+            lu[:, j+1:, j] /= pivots[:, None]
+            lu[:, j+1:, j+1:] -= lu[:, j+1:, j, None]*lu[:, j, None, j+1:]
+        self.k, self.n = k, n
+        self.lu = lu
+        self.perm = perm
+
+    def solve(self, b):
+        """Solves  A[s] x[s] = b[s]  for every system s.
+
+        b has shape (k, n), or (k, n, m) for m right hand sides per system.
+        """
+        x = np.array(b, float)
+        vector = x.ndim == 2
+        if vector:
+            x = x[:, :, None]
+        x = x[np.arange(self.k)[:, None], self.perm]
+        lu = self.lu
+        # Forward substitution (L has unit diagonal)
+        for i in range(1, self.n):
+            x[:, i] -= (lu[:, i, None, :i] @ x[:, :i])[:, 0]
+        # Back substitution
+        for i in range(self.n - 1, -1, -1):
+            x[:, i] = (x[:, i] - (lu[:, i, None, i+1:] @ x[:, i+1:])[:, 0])/lu[:, i, i, None]
+        return x[:, :, 0] if vector else x
+
+def batched_solve(matrices, b):
+    """Solves the stack of systems  matrices[s] x[s] = b[s]  (see `BatchedLUFactorization`)."""
+    return BatchedLUFactorization(matrices).solve(b)
 
 if __name__ == '__main__':
+    import time
+
     A = np.matrix('1 1 2; 3 5 9; 4 2 1')
     L,U,pivot_table = LU(A)
     P = get_permutation(pivot_table)
@@ -64,4 +407,48 @@ if __name__ == '__main__':
     print('L.U')
     print(L@U)
     print('P.L.U')
-    print(P@L@U)
\ No newline at end of file
+    print(P@L@U)
+
+    print('Factored once, solving for several b')
+    factorization = LUFactorization(A)
+    b = np.array(((1, 0), (2, 1), (3, 0)))
+    x = factorization.solve(b)
+    print(x)
+    print('A.x')
+    print(A@x)
+    print('A.A^-1')
+    print(A@factorization.inverse())
+    print('det A = {} (sign {}, log|det| {})'.format(
+        factorization.determinant, factorization.sign, factorization.logabsdet))
+
+    print('Mixed precision solve of the system at the end of Folha6Ex1')
+    SQRT2 = np.sqrt(2)
+    x, info = refined_solve(((-SQRT2, 2, 0), (1, -SQRT2, 1), (0, 2, -SQRT2)), (1, 1, 1))
+    print(x, info)
+
+    print('Sweeping the entry (0, 1) of a 1000x1000 system')
+    n = 1000
+    A = np.random.random((n, n)) + n*np.identity(n)
+    b = np.random.random(n)
+    factorization = LUFactorization(A)
+    e0, e1 = np.identity(n)[0], np.identity(n)[1]
+    start = time.perf_counter()
+    for delta in np.linspace(-10, 10, 20):
+        x = factorization.woodbury(delta*e0, e1).solve(b)
+    A[0, 1] += delta
+    print('Woodbury, 20 values: {:.3f}s, residual {:.2E}'.format(
+        time.perf_counter() - start, np.max(np.abs(A @ x - b))))
+    start = time.perf_counter()
+    factorization.update(delta*e0, e1)
+    x = factorization.solve(b)
+    print('Rank 1 LU update: {:.3f}s, residual {:.2E}'.format(
+        time.perf_counter() - start, np.max(np.abs(A @ x - b))))
+    print('log|det A| = {:.6f}, det A = {}'.format(factorization.logabsdet, factorization.determinant))
+
+    print('Batched solve of 10^5 random 4x4 systems')
+    As = np.random.random((100000, 4, 4))
+    bs = np.random.random((100000, 4))
+    start = time.perf_counter()
+    xs = batched_solve(As, bs)
+    print('Time: {:.3f}s'.format(time.perf_counter() - start))
+    print('Max. residual:', np.max(np.abs(np.einsum('kij,kj->ki', As, xs) - bs)))
\ No newline at end of file
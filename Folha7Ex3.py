@@ -2,7 +2,8 @@
 
 import numpy as np
 from numbers import Number
-from copy import copy
+from Folha7Ex2 import LUFactorization
+from matrix_io import read_text_matrix, load_triplets, save_triplets
 
 class SquareMatrix():
     def __init__(self, n : int = 0, c : dict = {}):
@@ -11,10 +12,11 @@ class SquareMatrix():
         self.__radd__=self.__add__ # Comutative addition
     def asnumpy(self):
         matrix = np.zeros((self.n, self.n), float)
-        for i in range(self.n):
-            for j in range(self.n):
-                matrix[i,j] = self.c.get(i, {}).get(j, 0)
+        for i, line in self.c.items():
+            matrix[i, list(line)] = list(line.values())
         return matrix
+    def assparse(self):
+        return SparseMatrix.from_dict(self.c, (self.n, self.n))
     def astuple(self):
         return tuple(
             tuple(
@@ -22,62 +24,25 @@ class SquareMatrix():
             ) for i in range(self.n)
         )
     def getdata(self, filename):
-        with open(filename) as file:
-            i = 0
-            for line in file.read().split('\n'):
-                j = 0
-                for column in line.split():
-                    self.c.setdefault(i, {})[j] = float(column)
-                    j += 1
-                i += 1
+        # Every entry is stored, zeros included (they print as 0.0)
+        for i, line in enumerate(read_text_matrix(filename).tolist()):
+            self.c.setdefault(i, {}).update(enumerate(line))
+    def gettriplets(self, filename):
+        """Reads a sparse triplet file (see matrix_io)."""
+        matrix = load_triplets(filename)
+        self.n = matrix.shape[0]
+        for i, line in matrix.todict().items():
+            self.c.setdefault(i, {}).update(line)
+    def savetriplets(self, filename):
+        save_triplets(filename, self)
     def getinverse(self):
-        matrix = self.asnumpy()
-        extended = np.concatenate((matrix, np.identity(self.n, float)), axis=1)
-        pivot_table = np.arange(self.n)
-        for j in range(self.n - 1):
-            pivot = max(range(j, self.n), key=lambda x: np.abs(extended[pivot_table[x],j]))
-            prev = pivot_table[j]
-            pivot_table[j] = pivot_table[pivot]
-            pivot_table[pivot] = prev
-            for i in range(j+1, self.n):
-                np.add(
-                    extended[pivot_table[i],:],
-                    -extended[pivot_table[j],:]/extended[pivot_table[j],j]*extended[pivot_table[i],j],
-                    out=extended[pivot_table[i],:]
-                )
-        result = np.zeros((self.n, self.n))
-        for j in range(self.n):
-            for i in range(self.n-1, -1, -1):
-                result[i,j] = (
-                    extended[pivot_table[i],self.n+j] - sum(extended[pivot_table[i],u]*result[u,j] for u in range(i+1,self.n))
-                )/extended[pivot_table[i],i]
+        result = LUFactorization(self.asnumpy()).inverse()
         return SquareMatrix(self.n, {i:{j:result[i,j] for j in range(self.n)} for i in range(self.n)})
     def computeLU(self):
-        matrix = self.asnumpy()
-        # i->i (identity) pivot_table
-        pivot_table = np.arange(0, self.n, 1)
-
-        L = np.zeros((self.n, self.n), float)
-        U = matrix # Not using copy for perf. and because arg should be ref anyway...
-        L, U = L.astype(float), U.astype(float) # Avoid troublesome casts
-
-        # Triangularization
-        for j in range(self.n-1):
-            # Consider partial pivot
-            pivot = max(range(j, self.n), key=lambda u: abs(U[pivot_table[u],j]))
-            prev = pivot_table[j]
-            pivot_table[j] = pivot_table[pivot]
-            pivot_table[pivot] = prev
-            # Eliminate and store coefficients
-            for i in range(j+1, self.n):
-                coef = U[pivot_table[i],j]/U[pivot_table[j],j]
-                L[i, pivot_table[j]] = coef
-                U[pivot_table[i],:] -= U[pivot_table[j],:]*coef
-    
-        # L starts as an identity matrix but has its columns
-        #  shifted around; so we only set the "diagonal" to 1
-        #  at the end.
-        L[np.arange(self.n), pivot_table] = 1.0
+        # Lines are swapped while pivoting: P @ self == L @ U
+        factorization = LUFactorization(self.asnumpy())
+        L, U = factorization.L, factorization.U
+        self.permutation = factorization.permutation
 
         # To dicts
         self.L = {i:{j:L[i,j] for j in range(self.n)} for i in range(self.n)}
@@ -112,37 +77,169 @@ class SquareMatrix():
         return result
     def __rmul__(self,other):
         if isinstance(other, Number):
-            result = copy(self)
-            for i in result.c:
-                for j in result.c[i]:
-                    result.c[i][j] *= other
-            return result
+            return SquareMatrix(self.n, {i:{j:value*other for j, value in line.items()} for i, line in self.c.items()})
         elif type(other) is not SquareMatrix:
             return SquareMatrix(0)
         return self*other
     def __mul__(self,other):
         if isinstance(other, Number):
-            result = copy(self)
-            for i in result.c:
-                for j in result.c[i]:
-                    result.c[i][j] *= other
-            return result
+            return SquareMatrix(self.n, {i:{j:value*other for j, value in line.items()} for i, line in self.c.items()})
         elif type(other) is not SquareMatrix:
             return SquareMatrix(0)
             #raise ValueError("Can onl multiply SquareMatrix by SquareMatrix or number.")
         if self.n != other.n:
             return SquareMatrix(0)
             #raise ValueError("Cannot multiply square matrices of different size.")
-        result = SquareMatrix(self.n, {})
-        for i in set(self.c)|set(other.c):
-            result.c[i] = {}
-            for j in set(self.c.get(i,0))|set(self.c.get(i,0)):
-                result.c[i][j] = sum(self.c.get(i,{}).get(u,0)*other.c.get(u,{}).get(j,0) for u in range(self.n))
-        return result
+        # Only over nonzero entries
+        return (self.assparse() @ other.assparse()).assquarematrix()
     def __str__(self):
         astuple = self.astuple()
         return '('+'\n '.join(str(astuple[i]) for i in range(self.n))+')'
 
+class SparseMatrix():
+    """Sparse matrix in compressed sparse row (CSR) form.
+
+    The nonzero entries of line i are `data[indptr[i]:indptr[i+1]]`,
+    in the columns `indices[indptr[i]:indptr[i+1]]` (sorted).
+    Build it with `from_coo` (triplets) or `from_dict` (the
+    `SquareMatrix.c` form); every operation is O(nnz).
+    """
+    def __init__(self, data, indices, indptr, shape):
+        self.data = np.asarray(data, float)
+        self.indices = np.asarray(indices, np.intp)
+        self.indptr = np.asarray(indptr, np.intp)
+        self.shape = tuple(shape)
+        # Line of each nonzero entry (the COO form), for the kernels
+        self.lines = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    @classmethod
+    def from_coo(cls, lines, columns, values, shape):
+        """Builds the matrix from (line, column, value) triplets.
+
+        Repeated (line, column) pairs are added together.
+        """
+        lines = np.asarray(lines, np.intp)
+        columns = np.asarray(columns, np.intp)
+        values = np.asarray(values, float)
+        order = np.lexsort((columns, lines))
+        lines, columns, values = lines[order], columns[order], values[order]
+        # Sum duplicates
+        if len(lines):
+            first = np.ones(len(lines), bool)
+            first[1:] = (lines[1:] != lines[:-1]) | (columns[1:] != columns[:-1])
+            starts = np.flatnonzero(first)
+            values = np.add.reduceat(values, starts)
+            lines, columns = lines[starts], columns[starts]
+        indptr = np.zeros(shape[0] + 1, np.intp)
+        np.cumsum(np.bincount(lines, minlength=shape[0]), out=indptr[1:])
+        return cls(values, columns, indptr, shape)
+
+    @classmethod
+    def from_dict(cls, c : dict, shape):
+        """Builds the matrix from a dict of dicts, c[i][j] = value."""
+        lines, columns, values = [], [], []
+        for i, line in c.items():
+            lines.extend((i,)*len(line))
+            columns.extend(line)
+            values.extend(line.values())
+        return cls.from_coo(lines, columns, values, shape)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        matrix = np.asarray(matrix, float)
+        lines, columns = np.nonzero(matrix)
+        return cls.from_coo(lines, columns, matrix[lines, columns], matrix.shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def tocoo(self):
+        """Returns the (lines, columns, values) triplets."""
+        return self.lines, self.indices, self.data
+
+    def todict(self):
+        c = {}
+        for i, j, value in zip(self.lines.tolist(), self.indices.tolist(), self.data.tolist()):
+            c.setdefault(i, {})[j] = value
+        return c
+
+    def assquarematrix(self):
+        if self.shape[0] != self.shape[1]:
+            raise ValueError('Cannot make SquareMatrix of non square matrix.')
+        return SquareMatrix(self.shape[0], self.todict())
+
+    def asnumpy(self):
+        matrix = np.zeros(self.shape)
+        matrix[self.lines, self.indices] = self.data
+        return matrix
+
+    def diagonal(self):
+        diagonal = np.zeros(min(self.shape))
+        on_diagonal = self.lines == self.indices
+        diagonal[self.lines[on_diagonal]] = self.data[on_diagonal]
+        return diagonal
+
+    @property
+    def T(self):
+        return SparseMatrix.from_coo(self.indices, self.lines, self.data, self.shape[::-1])
+
+    def __matmul__(self, other):
+        if isinstance(other, SparseMatrix):
+            return self._matmul_sparse(other)
+        x = np.asarray(other, float)
+        if x.shape[0] != self.shape[1]:
+            raise ValueError('Mismatched matrix and vector sizes.')
+        if x.ndim == 1:
+            return np.bincount(self.lines, weights=self.data*x[self.indices], minlength=self.shape[0])
+        # Several columns
+        products = self.data[:, None]*x[self.indices]
+        return np.stack(tuple(
+            np.bincount(self.lines, weights=products[:, k], minlength=self.shape[0])
+            for k in range(x.shape[1])), axis=1)
+
+    def _matmul_sparse(self, other):
+        if self.shape[1] != other.shape[0]:
+            raise ValueError('Mismatched matrix sizes.')
+        # Every nonzero self[i,k] meets every nonzero of line k of other
+        starts = other.indptr[self.indices]
+        counts = other.indptr[self.indices + 1] - starts
+        total = np.sum(counts)
+        # Position (in other) of each product term
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + offsets
+        return SparseMatrix.from_coo(
+            np.repeat(self.lines, counts),
+            other.indices[positions],
+            np.repeat(self.data, counts)*other.data[positions],
+            (self.shape[0], other.shape[1]))
+
+    def __mul__(self, other):
+        if isinstance(other, Number):
+            return SparseMatrix(self.data*other, self.indices, self.indptr, self.shape)
+        raise ValueError('Can only multiply SparseMatrix by number (use @ for products).')
+    __rmul__ = __mul__
+
+    def _combine(self, other, sign):
+        if not isinstance(other, SparseMatrix):
+            raise ValueError('Can only add SparseMatrix to SparseMatrix.')
+        if self.shape != other.shape:
+            raise ValueError('Cannot add matrices of different size.')
+        return SparseMatrix.from_coo(
+            np.concatenate((self.lines, other.lines)),
+            np.concatenate((self.indices, other.indices)),
+            np.concatenate((self.data, sign*other.data)),
+            self.shape)
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def __str__(self):
+        return 'SparseMatrix({}x{}, {} nonzero)'.format(*self.shape, self.nnz)
+
 if __name__ == '__main__':
     t = SquareMatrix(3, {})
     t.getdata('Folha7Ex3Test.txt')
@@ -160,5 +257,23 @@ if __name__ == '__main__':
     t.computeLU()
     L = SquareMatrix(3, t.L)
     U = SquareMatrix(3, t.U)
-    print('L@U')
-    print(L*U)
\ No newline at end of file
+    print('L@U (T with its lines swapped, P@T)')
+    print(L*U)
+    print('P.T@L@U')
+    PtLU = (t.permutation.T @ (L*U).asnumpy()).tolist()
+    print(SquareMatrix(3, {i:dict(enumerate(line)) for i, line in enumerate(PtLU)}))
+
+    print('Sparse 10^5 x 10^5, 0.01% dense')
+    import time
+    n = 10**5
+    nnz = n*n//10**4
+    start = time.perf_counter()
+    S = SparseMatrix.from_coo(
+        np.random.randint(0, n, nnz), np.random.randint(0, n, nnz), np.random.random(nnz), (n, n))
+    print('Built in {:.3f}s'.format(time.perf_counter() - start))
+    start = time.perf_counter()
+    S @ np.ones(n)
+    print('S@v in {:.3f}s'.format(time.perf_counter() - start))
+    start = time.perf_counter()
+    S2 = S @ S
+    print('S@S in {:.3f}s, {}'.format(time.perf_counter() - start, S2))
\ No newline at end of file
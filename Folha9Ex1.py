@@ -1,48 +1,13 @@
 # -*- coding:utf-8 -*-
 
 import numpy as np
+from proxy_io import register_proxy, save_proxy
+from Folha7Ex1 import solve
+from Folha7Ex2 import LUFactorization
 
-def solve(A : np.matrix, b : np.matrix) -> np.matrix:
-    """Solve matrix equation system  Ax = b  for x.
-    
-    This assumes A and b are given in np.matrix form.
-    This returns an np.matrix.
-    """
-    # Use floats
-    A = A.astype(float)
-    b = b.astype(float)
-    # Horizontal (i index) and vertical (j index) size
-    a_x, a_y = A.shape
-    # Pivoted to "true" matrix horizontal index
-    #  initialized to i->i (identity)
-    pivot_table = np.arange(0, a_y, 1)
-    # Get extended matrix
-    extended_matrix = np.concatenate((A, b), axis=1)
-    # Triangularization:
-    for j in range(0, a_x-1):
-        # Consider partial pivot
-        pivot = max(range(j, a_y), key=lambda i: np.abs(extended_matrix[pivot_table[i],j]))
-        prev = pivot_table[j]
-        pivot_table[j] = pivot_table[pivot]
-        pivot_table[pivot] = prev
-        # Eliminate
-        for i in range(j+1, a_y):
-            np.add(
-                extended_matrix[pivot_table[i],:],
-                -extended_matrix[pivot_table[j],:]/extended_matrix[pivot_table[j],j]*extended_matrix[pivot_table[i],j],
-                out=extended_matrix[pivot_table[i],:]
-            )
-
-    # Retro elimination
-    # at this point, the *swapped* matrix is diagonal
-    # Note that only lines were swapped, so the result
-    #  vector does not need to reference pivot_table
-    result = np.zeros((a_x, 1))
-    for i in range(a_y-1, -1, -1):
-        result[i] = (
-            extended_matrix[pivot_table[i],-1] - sum(extended_matrix[pivot_table[i],j]*result[j] for j in range(i+1,a_x))
-        )/extended_matrix[pivot_table[i],i]
-    return result
+CHUNK_SIZE = 2**16 # Points processed at once
+# Normal equations square the condition number; past this, use QR
+COND_LIMIT = 1e8
 
 def min_sqrs(x : np.array, y : np.array, deg: int) -> np.array:
     """Returns a min square approximation to the deg-function yielding (x,y).
@@ -51,34 +16,240 @@ def min_sqrs(x : np.array, y : np.array, deg: int) -> np.array:
     returns a `deg+1` length array of parameters `a_0 ... a_deg`
     such that
         `f(x) = a_0 + a_1 * x + ... + a_deg * x^(deg)` 
+
+    The normal equations only need the 2*deg + 1 moments  sum(x^k)
+    (A is the Hankel matrix A[i,j] = sum(x^(i+j))) and  b = V^T y,
+    V[u,i] = x[u]^i. Both are accumulated in a single pass over the
+    points, a chunk at a time, each power being the previous one times x.
     """
+    A, b = _normal_equations(x, y, deg)
+
+    # Solve system
+    result = solve(A, b[:, None]) # Column vector
+    return result[:, 0]
+
+def _normal_equations(x, y, deg):
+    """Returns (A, b) of `min_sqrs`."""
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
     if len(x) != len(y):
         raise ValueError('Mismatched x, y array size.')
 
-    A = np.zeros((deg + 1, deg + 1))
-    b = np.zeros((deg + 1, 1))
-    
-    # Init A
-    A_y, A_x = A.shape
-
-    # Take advantage of the symmetry
-    A[0,0] = len(x)
-    for i in range(A_y):
-        for j in range(i+1, A_x):
-            coef = sum(x[u]**(i+j) for u in range(len(x)))
-            A[i,j] = coef
-            A[j,i] = coef
-        A[i,i] = sum(x[u]**(2*i) for u in range(len(x))) # avoid double assignment
-    
-    # Init b
-    b_y, b_x = b.shape
-    b[0, 0] = sum(y[u] for u in range(len(y)))
-    for i in range(1, b_y):
-        b[i, 0] = sum(y[u]*x[u]**i for u in range(len(x)))
+    moments = np.zeros(2*deg + 1)
+    b = np.zeros(deg + 1)
+    for start in range(0, len(x), CHUNK_SIZE):
+        x_chunk = x[start:start + CHUNK_SIZE]
+        powers = np.empty((2*deg + 1, len(x_chunk)))
+        powers[0] = 1
+        for k in range(1, 2*deg + 1):
+            np.multiply(powers[k-1], x_chunk, out=powers[k])
+        moments += powers.sum(axis=1)
+        b += powers[:deg + 1] @ y[start:start + CHUNK_SIZE]
 
-    # Solve system
-    result = solve(A, b) # Column vector
-    return result.T[0] # Standard array (bit hacky)
+    A = moments[np.add.outer(np.arange(deg + 1), np.arange(deg + 1))]
+    return A, b
+
+def _to_domain(x, domain):
+    """Maps x from the interval `domain` onto [-1, 1] (no-op for None)."""
+    x = np.asarray(x, float)
+    if domain is None:
+        return x
+    a, b = domain
+    return (2*x - (a + b))/(b - a)
+
+def basis_matrix(t : np.array, deg : int, basis : str = 'monomial') -> np.array:
+    """Design matrix V[u, k] = phi_k(t[u]), phi_k = t^k or the Legendre P_k."""
+    if basis not in ('monomial', 'legendre'):
+        raise ValueError("`basis` should be 'monomial' or 'legendre'.")
+    t = np.asarray(t, float)
+    V = np.empty((deg + 1, len(t))) # Transposed while filling (contiguous lines)
+    V[0] = 1
+    if deg > 0:
+        V[1] = t
+    for k in range(1, deg):
+        if basis == 'legendre':
+            V[k+1] = ((2*k + 1)*t*V[k] - k*V[k-1])/(k + 1)
+        else:
+            V[k+1] = t*V[k]
+    return V.T
+
+def householder_fold(R, qty, V, y):
+    """Triangularizes [R; V] in place, applying the same reflections to [qty; y].
+
+    R is square upper triangular and V has as many columns; V and y
+    are overwritten. Returns the sum of squares left in y, which the
+    reflections can no longer reach (the residual of these rows).
+    Leading axes are a batch of independent problems, all folded at
+    once: R (..., p, p), qty (..., p), V (..., N, p), y (..., N).
+    """
+    for j in range(R.shape[-1]):
+        column = V[..., :, j].copy()
+        norm_column = np.linalg.norm(column, axis=-1)
+        # Reflection of (R[j, j], column) onto (alpha, 0); none for zero columns
+        alpha = -np.copysign(np.hypot(R[..., j, j], norm_column), R[..., j, j])
+        v0 = R[..., j, j] - alpha
+        denominator = v0**2 + norm_column**2
+        factor = np.divide(2, denominator, out=np.zeros_like(denominator), where=norm_column != 0)
+        w = factor[..., None]*(v0[..., None]*R[..., j, j:] + (column[..., None, :] @ V[..., :, j:])[..., 0, :])
+        R[..., j, j:] -= v0[..., None]*w
+        V[..., :, j:] -= column[..., :, None]*w[..., None, :]
+        w = factor*(v0*qty[..., j] + (column[..., None, :] @ y[..., :, None])[..., 0, 0])
+        qty[..., j] -= v0*w
+        y -= column*w[..., None]
+    return np.sum(y**2, axis=-1)
+
+def upper_solve(R, b) -> np.array:
+    """Solves  R x = b  by back substitution, R upper triangular; b a vector or a block.
+
+    As in `householder_fold`, leading axes of R (and b) are a batch.
+    """
+    x = np.array(b, float)
+    vector = x.ndim < R.ndim
+    if vector:
+        x = x[..., None]
+    for i in range(R.shape[-1] - 1, -1, -1):
+        x[..., i, :] = (x[..., i, :] - (R[..., i, None, i+1:] @ x[..., i+1:, :])[..., 0, :])/R[..., i, i, None]
+    return x[..., 0] if vector else x
+
+class QRLeastSquares:
+    """Least squares polynomial fit by Householder QR, streaming over the points.
+
+    Points are added in chunks (`add`), so the design matrix is never
+    built whole: only the (deg + 1) x (deg + 1) triangular R, Q^T y
+    and the residual sum of squares are kept, and each chunk is folded
+    in with Householder reflections of [R; V_chunk], in
+    O(len(chunk) * deg^2). Working on V rather than V^T V does not
+    square the condition number as `min_sqrs` does.
+
+    With a `domain` (a, b), x is mapped onto [-1, 1] first, which
+    scales (and centers) the columns of V; `basis` 'legendre' uses
+    Legendre polynomials there, whose columns are nearly orthogonal.
+    """
+    def __init__(self, deg : int, basis : str = 'monomial', domain=None):
+        if basis == 'legendre' and domain is None:
+            raise ValueError('The Legendre basis needs a domain.')
+        self.deg, self.basis = deg, basis
+        self.domain = None if domain is None else tuple(float(bound) for bound in domain)
+        self.R = np.zeros((deg + 1, deg + 1))
+        self.qty = np.zeros(deg + 1)
+        self.rss = 0.0 # Residual sum of squares
+        self.count = 0
+
+    def add(self, x, y):
+        """Adds the points (x, y), a chunk at a time."""
+        x = np.asarray(x, float)
+        y = np.asarray(y, float)
+        if len(x) != len(y):
+            raise ValueError('Mismatched x, y array size.')
+        for start in range(0, len(x), CHUNK_SIZE):
+            V = basis_matrix(_to_domain(x[start:start + CHUNK_SIZE], self.domain), self.deg, self.basis)
+            self._fold(V, y[start:start + CHUNK_SIZE].copy())
+        self.count += len(x)
+        return self
+
+    def _fold(self, V, y):
+        self.rss += householder_fold(self.R, self.qty, V, y)
+
+    def merge(self, other):
+        """Adds the points of another QRLeastSquares (same deg, basis and domain).
+
+        Lets chunks be accumulated separately (e.g. in other processes)
+        and combined: [R; R_other] is triangularized like any chunk.
+        """
+        if (other.deg, other.basis, other.domain) != (self.deg, self.basis, self.domain):
+            raise ValueError('Cannot merge fits of different degree, basis or domain.')
+        self._fold(other.R.copy(), other.qty.copy())
+        self.rss += other.rss
+        self.count += other.count
+        return self
+
+    def condition_estimate(self):
+        """Estimated 1-norm condition number of R (as that of V)."""
+        return LUFactorization(self.R).condition_estimate()
+
+    def solve(self) -> np.array:
+        """Coefficients, in the basis (and variable) of the fit."""
+        return upper_solve(self.R, self.qty)
+
+    def fit(self):
+        """The `PolynomialFit` of the points added so far."""
+        return PolynomialFit(self.solve(), self.basis, self.domain)
+
+def qr_sqrs(x : np.array, y : np.array, deg : int, basis : str = 'monomial', domain=None) -> np.array:
+    """As `min_sqrs`, by Householder QR of the design matrix (see `QRLeastSquares`).
+
+    The coefficients are in `basis`, of x mapped from `domain` to [-1, 1].
+    """
+    return QRLeastSquares(deg, basis, domain).add(x, y).solve()
+
+@register_proxy
+class PolynomialFit:
+    """Polynomial `f(x) = coefs[0] + coefs[1] * x + ... + coefs[deg] * x^(deg)`.
+
+    Usually obtained from `PolynomialFit.fit`.
+    Can be called with a number or an array of x values.
+    With a `domain` (a, b) the polynomial is in t, x mapped onto
+    [-1, 1], and `basis` may be 'legendre':
+        `f(x) = coefs[0] * P_0(t) + ... + coefs[deg] * P_deg(t)`
+    """
+    def __init__(self, coefs : np.array, basis : str = 'monomial', domain=None):
+        self.coefs = coefs
+        self.basis = basis
+        self.domain = None if domain is None else tuple(float(bound) for bound in domain)
+
+    @classmethod
+    def fit(cls, x : np.array, y : np.array, deg : int, method : str = 'auto'):
+        """Least squares fit of degree `deg`.
+
+        `method` 'normal' solves the normal equations (`min_sqrs`),
+        'qr' uses `QRLeastSquares` in the Legendre basis over the range
+        of x, and 'auto' solves the normal equations unless their
+        condition estimate is above COND_LIMIT, then uses QR.
+        """
+        if method not in ('auto', 'normal', 'qr'):
+            raise ValueError("`method` should be 'auto', 'normal' or 'qr'.")
+        if method != 'qr':
+            A, b = _normal_equations(x, y, deg)
+            if method == 'normal' or LUFactorization(A).condition_estimate() <= COND_LIMIT:
+                return cls(solve(A, b[:, None])[:, 0])
+        x = np.asarray(x, float)
+        domain = (np.min(x), np.max(x))
+        if domain[0] == domain[1]:
+            domain = (domain[0] - 1, domain[1] + 1)
+        return QRLeastSquares(deg, 'legendre', domain).add(x, y).fit()
+
+    @property
+    def deg(self):
+        return len(self.coefs) - 1
+
+    def __call__(self, x):
+        t = _to_domain(x, self.domain)
+        if self.basis == 'legendre':
+            # Clenshaw's recurrence
+            result, following = np.zeros(t.shape), np.zeros(t.shape)
+            for k in range(self.deg, -1, -1):
+                result, following = self.coefs[k] + (2*k + 1)/(k + 1)*t*result - (k + 1)/(k + 2)*following, result
+            return result[()]
+        # Horner's scheme
+        result = np.full(t.shape, self.coefs[-1], float)
+        for coef in self.coefs[-2::-1]:
+            result *= t
+            result += coef
+        return result[()] # Unwrap scalars
+
+    def proxy_arrays(self):
+        return {'coefs': self.coefs}
+
+    def proxy_meta(self):
+        return {'basis': self.basis, 'domain': self.domain}
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        return cls(arrays['coefs'], meta.get('basis', 'monomial'), meta.get('domain'))
+
+    def save(self, filename):
+        """Saves the fit; reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
 
 # Testing
 if __name__ == '__main__':
@@ -90,8 +261,7 @@ if __name__ == '__main__':
 
     # Perform several deg. adjustments & plot
     for deg in range(1, 4):
-        coefs = min_sqrs(x, y, deg)
-        f = lambda x: sum(coefs[u]*x**u for u in range(len(coefs)))
+        f = PolynomialFit.fit(x, y, deg)
 
         x_plt = np.linspace(-3, 12, 100)
         y_plt = f(x_plt)
@@ -1,27 +1,30 @@
 # -*- coding:utf-8 -*-
 
 import numpy as np
-# Please include Folha9Ex1.py in the same folder!
-from Folha9Ex1 import min_sqrs
+# Please include Folha9Ex1.py and least_squares.py in the same folder!
+from matrix_io import read_text_matrix
+from least_squares import fit_all_degrees
 
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
     # Parse data
-    with open('valores.dat') as file_io:
-        pairs = tuple(map(lambda x: x.split(' '), filter(None, file_io.read().split('\n'))))
-    x,y = tuple(map(lambda u: float(u[0]), pairs)), tuple(map(lambda u: float(u[1]), pairs))
-    x,y = np.array(x), np.array(y)
+    x, y = read_text_matrix('valores.dat').T
+
+    # Every degree at once (one pass over the data)
+    selection = fit_all_degrees(x, y, 7)
+    results = selection.results()[1:]
+    for result in results:
+        print('Degree {deg}: rss {rss:.4E}, AIC {aic:.2f}, BIC {bic:.2f}, CV {cv:.4E}'.format(**result))
+    print('Best degree by BIC:', selection.best('bic')['deg'])
+    fits = [result['fit'] for result in results]
 
     # Plot
     x_plt = np.linspace(x[0] - 1, x[-1] + 1, 100)
-    for deg in range(1, 8):
-        coefs = min_sqrs(x, y, deg)
-        f = lambda x: sum(coefs[u]*x**u for u in range(len(coefs)))
-
+    for f in fits:
         y_plt = f(x_plt)
         
-        plt.plot(x_plt, y_plt, label='{} deg. polynomial'.format(deg))
+        plt.plot(x_plt, y_plt, label='{} deg. polynomial'.format(f.deg))
     plt.legend(loc='best')
     plt.plot(x, y, 'o')
     plt.show()
@@ -31,13 +34,10 @@ if __name__ == '__main__':
     plt.ylim(np.min(y) - 20, np.max(y) + 20)
     plt.xlim(x[0] - 10, x[-1] + 10)
     x_plt = np.linspace(x[0] - 10, x[-1] + 10, 100)
-    for deg in range(1, 8):
-        coefs = min_sqrs(x, y, deg)
-        f = lambda x: sum(coefs[u]*x**u for u in range(len(coefs)))
-
+    for f in fits:
         y_plt = f(x_plt)
         
-        plt.plot(x_plt, y_plt, label='{} deg. polynomial'.format(deg))
+        plt.plot(x_plt, y_plt, label='{} deg. polynomial'.format(f.deg))
     plt.legend(loc='best')
     plt.plot(x, y, 'o')
     plt.show()
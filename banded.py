@@ -0,0 +1,196 @@
+# -*- coding:utf-8 -*-
+
+"""Banded matrices and tridiagonal solvers.
+
+`BandedMatrix` keeps only the diagonals of the band, in the LAPACK
+layout, and `BandedLUFactorization` solves with it in O(n*bw^2).
+`thomas` solves many tridiagonal systems (splines, implicit steps,
+1D PDEs) in one call.
+"""
+
+import numpy as np
+
+def thomas(lower, diagonal, upper, rhs):
+    """Solves tridiagonal systems with the Thomas algorithm, all at once.
+
+    Line i of each system reads
+        lower[i]*x[i-1] + diagonal[i]*x[i] + upper[i]*x[i+1] = rhs[i]
+    (lower[0] and upper[-1] are ignored). The last axis runs along
+    each system and the other axes enumerate systems; coefficients
+    broadcast against rhs, so 1D coefficients share one matrix among
+    all right hand sides.
+    There is no pivoting: meant for diagonally dominant systems.
+    """
+    coef_shape = np.broadcast_shapes(np.shape(lower), np.shape(diagonal), np.shape(upper))
+    a, b, c = (
+        np.moveaxis(np.broadcast_to(np.asarray(coefs, float), coef_shape), -1, 0)
+        for coefs in (lower, diagonal, upper))
+    n = b.shape[0]
+    # Forward elimination of the matrix (only depends on the coefficients)
+    denominator = np.empty(b.shape)
+    c_prime = np.empty(b.shape)
+    denominator[0] = b[0]
+    c_prime[0] = c[0]/b[0]
+    for i in range(1, n):
+        denominator[i] = b[i] - a[i]*c_prime[i-1]
+        c_prime[i] = c[i]/denominator[i]
+    # Sweep the right hand sides, with the system axis first (contiguous)
+    x = np.moveaxis(np.asarray(rhs, float), -1, 0)
+    x = np.array(np.broadcast_to(x, (n,) + np.broadcast_shapes(b.shape[1:], x.shape[1:])))
+    x[0] /= denominator[0]
+    for i in range(1, n):
+        x[i] = (x[i] - a[i]*x[i-1])/denominator[i]
+    for i in range(n - 2, -1, -1):
+        x[i] -= c_prime[i]*x[i+1]
+    return np.moveaxis(x, 0, -1)
+
+class BandedMatrix:
+    """n x n matrix with `kl` sub-diagonals and `ku` super-diagonals.
+
+    Stored LAPACK style, in a (kl + ku + 1, n) array:
+        A[i, j] = ab[ku + i - j, j]
+    """
+    def __init__(self, ab, kl : int, ku : int):
+        self.ab = np.asarray(ab, float)
+        self.kl, self.ku = kl, ku
+        self.n = self.ab.shape[1]
+        if self.ab.shape[0] != kl + ku + 1:
+            raise ValueError('Band storage should have kl + ku + 1 lines.')
+
+    @classmethod
+    def from_dense(cls, matrix, kl : int, ku : int):
+        matrix = np.asarray(matrix, float)
+        n = matrix.shape[0]
+        ab = np.zeros((kl + ku + 1, n))
+        for offset in range(-kl, ku + 1):
+            # Diagonal offset (j - i) goes to line ku - offset
+            diagonal = np.diagonal(matrix, offset)
+            if offset >= 0:
+                ab[ku - offset, offset:] = diagonal
+            else:
+                ab[ku - offset, :n + offset] = diagonal
+        return cls(ab, kl, ku)
+
+    @classmethod
+    def from_diagonals(cls, diagonals : dict, n : int):
+        """Builds the matrix from {offset: diagonal}, offset = j - i."""
+        kl = max(0, -min(diagonals))
+        ku = max(0, max(diagonals))
+        ab = np.zeros((kl + ku + 1, n))
+        for offset, diagonal in diagonals.items():
+            if offset >= 0:
+                ab[ku - offset, offset:] = diagonal
+            else:
+                ab[ku - offset, :n + offset] = diagonal
+        return cls(ab, kl, ku)
+
+    def asnumpy(self):
+        matrix = np.zeros((self.n, self.n))
+        for offset in range(-self.kl, self.ku + 1):
+            j = np.arange(max(0, offset), min(self.n, self.n + offset))
+            matrix[j - offset, j] = self.ab[self.ku - offset, j]
+        return matrix
+
+    def __matmul__(self, other):
+        x = np.asarray(other, float)
+        result = np.zeros(x.shape)
+        for offset in range(-self.kl, self.ku + 1):
+            lo, hi = max(0, offset), min(self.n, self.n + offset)
+            diagonal = self.ab[self.ku - offset, lo:hi]
+            if x.ndim > 1:
+                diagonal = diagonal[:, None]
+            result[lo - offset:hi - offset] += diagonal*x[lo:hi]
+        return result
+
+class BandedLUFactorization:
+    """LU decomposition with partial pivoting of a BandedMatrix.
+
+    Works as LAPACK's gbtrf: pivoting can fill in up to kl more
+    super-diagonals of U, so the factors are kept in a
+    (2*kl + ku + 1, n) band,
+        U[i, j] = lu[kl + ku + i - j, j]      (i <= j)
+        multipliers of column j = lu[kl + ku + 1:, j]
+    and line j was swapped with line pivots[j] at step j.
+    Costs O(n*kl*(kl + ku)) to factor and O(n*(kl + ku)) per solve.
+    """
+    def __init__(self, matrix : BandedMatrix):
+        n, kl, ku = matrix.n, matrix.kl, matrix.ku
+        lu = np.zeros((2*kl + ku + 1, n))
+        lu[kl:] = matrix.ab
+        pivots = np.arange(n)
+        diag = kl + ku # Line of the diagonal in `lu`
+        for j in range(n):
+            last_line = min(n, j + kl + 1)
+            last_column = min(n, j + kl + ku + 1)
+            columns = np.arange(j, last_column)
+            # Partial pivot among the lines reaching column j
+            pivot = j + np.argmax(np.abs(lu[diag:diag + last_line - j, j]))
+            pivots[j] = pivot
+            if pivot != j:
+                line_j = lu[diag + j - columns, columns]
+                lu[diag + j - columns, columns] = lu[diag + pivot - columns, columns]
+                lu[diag + pivot - columns, columns] = line_j
+            if lu[diag, j] == 0 or last_line == j + 1:
+                continue
+            # Store multipliers and update the block below/right of the pivot
+            lu[diag + 1:diag + last_line - j, j] /= lu[diag, j]
+            multipliers = lu[diag + 1:diag + last_line - j, j]
+            lines = np.arange(j + 1, last_line)
+            columns = columns[1:]
+            lu[diag + lines[:, None] - columns, columns] -= np.outer(multipliers, lu[diag + j - columns, columns])
+        self.n, self.kl, self.ku = n, kl, ku
+        self.lu = lu
+        self.pivots = pivots
+
+    def solve(self, b):
+        """Solves  Ax = b  for a vector b, shape (n,), or a block, shape (n, m)."""
+        n, kl, ku = self.n, self.kl, self.ku
+        lu, diag = self.lu, kl + ku
+        x = np.array(b, float)
+        # Forward: line swaps and L (unit diagonal)
+        for j in range(n):
+            pivot = self.pivots[j]
+            if pivot != j:
+                x[[j, pivot]] = x[[pivot, j]]
+            last_line = min(n, j + kl + 1)
+            if last_line > j + 1:
+                multipliers = lu[diag + 1:diag + last_line - j, j]
+                if x.ndim > 1:
+                    multipliers = multipliers[:, None]
+                x[j+1:last_line] -= multipliers*x[j]
+        # Back substitution with U (kl + ku super-diagonals)
+        for i in range(n - 1, -1, -1):
+            columns = np.arange(i + 1, min(n, i + kl + ku + 1))
+            x[i] = (x[i] - lu[diag + i - columns, columns] @ x[i+1:i+1+len(columns)])/lu[diag, i]
+        return x
+
+if __name__ == '__main__':
+    import time
+    from Folha7Ex2 import LUFactorization
+
+    n = 2000
+    diagonals = {offset: np.random.random(n - abs(offset)) for offset in (-2, -1, 0, 1, 2, 3)}
+    A = BandedMatrix.from_diagonals(diagonals, n)
+    b = np.random.random(n)
+
+    start = time.perf_counter()
+    x = BandedLUFactorization(A).solve(b)
+    print('Banded LU solve, n={}: {:.3f}s, residual {:.2E}'.format(
+        n, time.perf_counter() - start, np.max(np.abs(A @ x - b))))
+    dense = A.asnumpy()
+    start = time.perf_counter()
+    x = LUFactorization(dense).solve(b)
+    print('Dense LU solve, n={}: {:.3f}s, residual {:.2E}'.format(
+        n, time.perf_counter() - start, np.max(np.abs(dense @ x - b))))
+
+    k, n = 100000, 50
+    lower, upper = np.random.random((k, n)), np.random.random((k, n))
+    diagonal = 2 + lower + upper
+    rhs = np.random.random((k, n))
+    start = time.perf_counter()
+    x = thomas(lower, diagonal, upper, rhs)
+    residual = diagonal*x - rhs
+    residual[:, 1:] += lower[:, 1:]*x[:, :-1]
+    residual[:, :-1] += upper[:, :-1]*x[:, 1:]
+    print('Thomas, {} systems of size {}: {:.3f}s, residual {:.2E}'.format(
+        k, n, time.perf_counter() - start, np.max(np.abs(residual))))
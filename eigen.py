@@ -0,0 +1,288 @@
+# -*- coding:utf-8 -*-
+
+"""Eigenvalues and eigenvectors.
+
+`power_iteration` and `inverse_iteration` find one eigenpair: the
+eigenvalue farthest from, or closest to, a shift. `symmetric_eigen`
+diagonalizes a dense symmetric matrix (Householder reduction to
+tridiagonal form, then implicit shifted QL). `lanczos` finds a few
+extremal eigenpairs of a large symmetric operator, typically a
+SparseMatrix, using only products `A @ x`.
+
+As in `iterative`, A may be a SparseMatrix, a SquareMatrix or a dense
+array.
+"""
+
+from math import hypot, copysign
+import numpy as np
+from Folha7Ex2 import LUFactorization
+from Folha7Ex3 import SparseMatrix
+from iterative import _as_operator, gmres, ILU0Preconditioner, JacobiPreconditioner
+
+def _random_start(n, x0):
+    x = np.random.default_rng(0).standard_normal(n) if x0 is None else np.array(x0, float)
+    return x/np.linalg.norm(x)
+
+def _shifted(A, shift):
+    """A - shift*I, for dense or sparse A."""
+    n = A.shape[0]
+    if isinstance(A, SparseMatrix):
+        diagonal = np.arange(n)
+        return A - SparseMatrix.from_coo(diagonal, diagonal, np.full(n, float(shift)), A.shape)
+    return A - shift*np.eye(n)
+
+def power_iteration(A, x0=None, shift : float = 0.0, tol : float = 1e-10, max_iter : int = 10000):
+    """Eigenpair of A whose eigenvalue is farthest from `shift`.
+
+    Iterates  x <- (A - shift I) x / ||.||  and estimates the eigenvalue
+    with the Rayleigh quotient. Returns (value, vector, residuals),
+    with residuals[k] = ||A x_k - value_k x_k|| / |value_k|.
+    """
+    A = _as_operator(A)
+    x = _random_start(A.shape[0], x0)
+    Ax = A @ x
+    value = x @ Ax
+    residuals = [np.linalg.norm(Ax - value*x)/max(abs(value), np.finfo(float).tiny)]
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        x = Ax - shift*x
+        x /= np.linalg.norm(x)
+        Ax = A @ x
+        value = x @ Ax
+        residuals.append(np.linalg.norm(Ax - value*x)/max(abs(value), np.finfo(float).tiny))
+    return value, x, residuals
+
+def inverse_iteration(A, shift : float = 0.0, x0=None, tol : float = 1e-10, max_iter : int = 1000):
+    """Eigenpair of A whose eigenvalue is closest to `shift`.
+
+    Iterates  x <- (A - shift I)^-1 x / ||.||. Dense A - shift I is LU
+    factored once; sparse A - shift I is solved with ILU(0)
+    preconditioned GMRES (Jacobi, or no, preconditioning when an
+    interior shift makes ILU(0) break down). Returns (value, vector, residuals), as
+    `power_iteration`.
+    """
+    A = _as_operator(A)
+    shifted = _shifted(A, shift)
+    if isinstance(shifted, SparseMatrix):
+        try:
+            preconditioner = ILU0Preconditioner(shifted)
+        except ValueError:
+            diagonal = shifted.diagonal()
+            preconditioner = JacobiPreconditioner(shifted) if np.all(diagonal != 0) else None
+        solve = lambda r: gmres(shifted, r, tol=1e-12, preconditioner=preconditioner)[0]
+    else:
+        solve = LUFactorization(shifted).solve
+    x = _random_start(A.shape[0], x0)
+    Ax = A @ x
+    value = x @ Ax
+    residuals = [np.linalg.norm(Ax - value*x)/max(abs(value), np.finfo(float).tiny)]
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        x = solve(x)
+        x /= np.linalg.norm(x)
+        Ax = A @ x
+        value = x @ Ax
+        residuals.append(np.linalg.norm(Ax - value*x)/max(abs(value), np.finfo(float).tiny))
+    return value, x, residuals
+
+def tridiagonalize(matrix, vectors : bool = True):
+    """Householder reduction of a symmetric matrix,  A = Q T Q^T.
+
+    Returns (d, e, Q): the diagonal and sub-diagonal of the
+    tridiagonal T, and the orthogonal Q (None if not `vectors`).
+    """
+    A = np.array(matrix, float)
+    n = len(A)
+    Q = np.eye(n) if vectors else None
+    for k in range(n - 2):
+        x = A[k+1:, k]
+        norm = np.linalg.norm(x)
+        if norm == 0 or norm == abs(x[0]):
+            continue # Already tridiagonal in this column
+        alpha = -copysign(norm, x[0])
+        v = x.copy()
+        v[0] -= alpha
+        v /= np.linalg.norm(v)
+        # H B H = B - 2 v q^T - 2 q v^T,  with p = B v and q = p - (v.p) v
+        B = A[k+1:, k+1:]
+        p = B @ v
+        q = p - (v @ p)*v
+        B -= 2*(np.outer(v, q) + np.outer(q, v))
+        A[k+1, k] = A[k, k+1] = alpha
+        A[k+2:, k] = A[k, k+2:] = 0
+        if vectors:
+            Q[:, k+1:] -= 2*np.outer(Q[:, k+1:] @ v, v)
+    return np.diagonal(A).copy(), np.diagonal(A, -1).copy(), Q
+
+def tridiagonal_eigen(d, e, Q=None, max_iter : int = 30):
+    """Eigenvalues (and eigenvectors) of a symmetric tridiagonal matrix.
+
+    Implicit shifted QL, with Wilkinson shifts and deflation.
+    `d` is the diagonal and `e` the sub-diagonal. The rotations are
+    accumulated on the columns of Q (e.g. from `tridiagonalize`), so
+    the eigenvectors of  Q T Q^T  come out; with no Q, only the
+    eigenvalues are computed. Returns (values, vectors), unsorted.
+    """
+    d = np.array(d, float)
+    n = len(d)
+    e = np.append(np.asarray(e, float), 0.0) # e[i] couples d[i] and d[i+1]
+    d_list, e_list = d.tolist(), e.tolist()
+    Z = None if Q is None else np.array(Q, float).T # Rows are rotated
+    eps = np.finfo(float).eps
+    for l in range(n):
+        for iteration in range(max_iter + 1):
+            # Look for a small sub-diagonal entry to split the matrix
+            m = l
+            while m < n - 1:
+                if abs(e_list[m]) <= eps*(abs(d_list[m]) + abs(d_list[m+1])):
+                    break
+                m += 1
+            if m == l:
+                break
+            if iteration == max_iter:
+                raise ValueError('QL iteration did not converge.')
+            g = (d_list[l+1] - d_list[l])/(2*e_list[l])
+            r = hypot(g, 1.0)
+            g = d_list[m] - d_list[l] + e_list[l]/(g + copysign(r, g))
+            s = c = 1.0
+            p = 0.0
+            i = m - 1
+            while i >= l:
+                f, b = s*e_list[i], c*e_list[i]
+                r = hypot(f, g)
+                e_list[i+1] = r
+                if r == 0:
+                    # Underflow: deflate and start over
+                    d_list[i+1] -= p
+                    e_list[m] = 0.0
+                    break
+                s, c = f/r, g/r
+                g = d_list[i+1] - p
+                r = (d_list[i] - g)*s + 2*c*b
+                p = s*r
+                d_list[i+1] = g + p
+                g = c*r - b
+                if Z is not None:
+                    Z[i], Z[i+1] = c*Z[i] - s*Z[i+1], s*Z[i] + c*Z[i+1]
+                i -= 1
+            else:
+                d_list[l] -= p
+                e_list[l] = g
+                e_list[m] = 0.0
+    return np.array(d_list), (None if Z is None else Z.T)
+
+def symmetric_eigen(matrix, vectors : bool = True):
+    """Eigenvalues (ascending) and eigenvectors (columns) of a symmetric matrix."""
+    d, e, Q = tridiagonalize(matrix, vectors)
+    values, Z = tridiagonal_eigen(d, e, Q)
+    order = np.argsort(values)
+    return values[order], (None if Z is None else Z[:, order])
+
+def lanczos(A, k : int = 6, which : str = 'smallest', ncv : int = None, tol : float = 1e-8,
+            max_restarts : int = 1000, x0=None):
+    """Thick restart Lanczos for `k` extremal eigenpairs of a symmetric A.
+
+    `which` is 'smallest' or 'largest'. Keeps `ncv` (default
+    max(5k, 40)) basis vectors of length n, fully
+    reorthogonalized; when the basis is full, it restarts from the
+    Ritz vectors nearest the wanted end. Clustered spectra, such as
+    the lowest modes of a large lattice, converge faster with a
+    larger `ncv`. Only `A @ x` is used, so SparseMatrix operators
+    are never densified.
+    Returns (values, vectors), values in ascending order and
+    vectors as columns; a pair is converged when
+    ||A x - value x|| <= tol*||A||.
+    """
+    if which not in ('smallest', 'largest'):
+        raise ValueError("`which` should be 'smallest' or 'largest'.")
+    A = _as_operator(A)
+    n = A.shape[0]
+    m = min(n, ncv if ncv is not None else max(5*k, 40))
+    if not 0 < k < m or (m < n and k >= m - 1):
+        raise ValueError('Need 0 < k < ncv - 1 (or ncv = n).')
+    rng = np.random.default_rng(0)
+    V = np.zeros((m + 1, n))
+    V[0] = _random_start(n, x0)
+    T = np.zeros((m, m))
+    kept = 0
+    for restart in range(max_restarts):
+        for j in range(kept, m):
+            w = A @ V[j]
+            # Classical Gram-Schmidt, twice
+            h = V[:j+1] @ w
+            w -= V[:j+1].T @ h
+            correction = V[:j+1] @ w
+            w -= V[:j+1].T @ correction
+            h += correction
+            T[:j+1, j] = T[j, :j+1] = h
+            beta = np.linalg.norm(w)
+            if beta <= 1e-12*max(1.0, np.abs(h).max()):
+                # Invariant subspace: continue with any orthogonal direction
+                w = rng.standard_normal(n)
+                w -= V[:j+1].T @ (V[:j+1] @ w)
+                w -= V[:j+1].T @ (V[:j+1] @ w)
+                beta = 0.0
+            V[j+1] = w/np.linalg.norm(w)
+            if j + 1 < m:
+                T[j+1, j] = T[j, j+1] = beta
+        if m == n:
+            beta = 0.0
+        values, S = symmetric_eigen(T)
+        norm = max(abs(values[0]), abs(values[-1]))
+        residuals = np.abs(beta*S[-1])
+        wanted = np.arange(k) if which == 'smallest' else np.arange(m - k, m)
+        if np.all(residuals[wanted] <= tol*norm):
+            return values[wanted], V[:m].T @ S[:, wanted]
+        # Keep the Ritz pairs nearest the wanted end
+        kept = min(m - 1, k + (m - k)//2)
+        keep = np.arange(kept) if which == 'smallest' else np.arange(m - kept, m)
+        V[:kept] = S[:, keep].T @ V[:m]
+        V[kept] = V[m]
+        T[:] = 0
+        T[np.arange(kept), np.arange(kept)] = values[keep]
+    raise ValueError('Lanczos did not converge in {} restarts.'.format(max_restarts))
+
+if __name__ == '__main__':
+    import time
+
+    n = 300
+    M = np.random.random((n, n))
+    M = M + M.T
+    start = time.perf_counter()
+    values, vectors = symmetric_eigen(M)
+    print('Dense symmetric {}x{}: {:.3f}s, max. |A v - l v| {:.2E}'.format(
+        n, n, time.perf_counter() - start, np.max(np.abs(M @ vectors - vectors*values))))
+
+    value, vector, residuals = power_iteration(M)
+    print('Power iteration: {:.6f} ({} iterations), largest |eigenvalue| {:.6f}'.format(
+        value, len(residuals) - 1, values[np.argmax(np.abs(values))]))
+    value, vector, residuals = inverse_iteration(M, shift=1.0)
+    print('Inverse iteration: {:.6f} ({} iterations), closest to 1 {:.6f}'.format(
+        value, len(residuals) - 1, values[np.argmin(np.abs(values - 1))]))
+
+    # Normal modes of a square lattice of coupled oscillators (free ends)
+    N = 100
+    index = np.arange(N*N).reshape(N, N)
+    lines, columns, values = [], [], []
+    for this, other in ((index[1:], index[:-1]), (index[:, 1:], index[:, :-1])):
+        lines += [this.ravel(), other.ravel(), this.ravel(), other.ravel()]
+        columns += [other.ravel(), this.ravel(), this.ravel(), other.ravel()]
+        values += [np.full(this.size, -1.0)]*2 + [np.full(this.size, 1.0)]*2
+    A = SparseMatrix.from_coo(np.concatenate(lines), np.concatenate(columns), np.concatenate(values), (N*N, N*N))
+    start = time.perf_counter()
+    values, vectors = lanczos(A, 20)
+    exact = np.sort((2 - 2*np.cos(np.pi*np.arange(N)/N))[:, None] + (2 - 2*np.cos(np.pi*np.arange(N)/N))[None, :], axis=None)[:20]
+    print('Lanczos, lowest 20 modes of {} oscillators: {:.3f}s, max. error {:.2E}'.format(
+        N*N, time.perf_counter() - start, np.max(np.abs(values - exact))))
+
+    # A mode from the middle of the spectrum of a chain of oscillators
+    # (fixed ends): A - shift I is indefinite, with a tiny diagonal, so
+    # ILU(0) is rejected and GMRES falls back to Jacobi (and is slow)
+    N, shift = 200, 2.0005
+    chain = SparseMatrix.from_coo(
+        np.concatenate((np.arange(N), np.arange(1, N), np.arange(N - 1))),
+        np.concatenate((np.arange(N), np.arange(N - 1), np.arange(1, N))),
+        np.concatenate((np.full(N, 2.0), np.full(2*(N - 1), -1.0))), (N, N))
+    start = time.perf_counter()
+    value, vector, residuals = inverse_iteration(chain, shift=shift)
+    exact = 2 - 2*np.cos(np.pi*np.arange(1, N + 1)/(N + 1))
+    print('Inverse iteration, chain of {}, shift {}: {:.6f} ({} iterations, {:.3f}s), closest {:.6f}'.format(
+        N, shift, value, len(residuals) - 1, time.perf_counter() - start, exact[np.argmin(np.abs(exact - shift))]))
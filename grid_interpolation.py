@@ -0,0 +1,197 @@
+# -*- coding:utf-8 -*-
+
+"""Interpolation of data tabulated on regular (rectilinear) grids.
+
+Works for any number of dimensions; values are given as an array
+with one axis per grid axis, or as the name of a .npy file, which is
+then memory-mapped so the table does not need to fit in memory.
+Query points are given in batches, as an array of shape (..., dim).
+"""
+
+import os
+from itertools import product
+import numpy as np
+from proxy_io import register_proxy, save_proxy
+from banded import thomas
+
+def _as_table(values):
+    """Opens a .npy file name as a read-only memmap, or passes arrays through."""
+    if isinstance(values, (str, os.PathLike)):
+        return np.load(values, mmap_mode='r')
+    return values
+
+def _second_derivatives(x, values, axis, out, chunk_size=2**22):
+    """Writes to `out` the natural spline 2nd derivatives of `values` along `axis`.
+
+    All the splines along `axis` are solved at once, sweeping slabs of
+    about `chunk_size` values so memory-mapped tables stay on disk.
+    """
+    n = len(x)
+    if n < 3:
+        # Linear along this axis
+        out[...] = 0
+        return
+    h = np.diff(x)
+    # Slabs are cut along some axis other than `axis`
+    other = 1 if axis == 0 else 0
+    if values.ndim == 1:
+        slabs = (slice(None),)
+    else:
+        step = max(1, chunk_size*values.shape[other]//max(1, values.size))
+        slabs = tuple(slice(start, start + step) for start in range(0, values.shape[other], step))
+    for slab in slabs:
+        index = [slice(None)]*values.ndim
+        if values.ndim > 1:
+            index[other] = slab
+        index = tuple(index)
+        y = np.moveaxis(np.asarray(values[index], float), axis, -1)
+        z = np.diff(y, axis=-1)/h
+        M = np.zeros_like(y)
+        M[..., 1:-1] = thomas(h[:-1], 2*(h[:-1] + h[1:]), h[1:], 6*np.diff(z, axis=-1))
+        out[index] = np.moveaxis(M, -1, axis)
+
+class GridInterpolation:
+    """Base for interpolations on the grid `axes[0] x axes[1] x ...`.
+
+    `axes` are strictly increasing 1D arrays and `values` has shape
+    `tuple(len(axis) for axis in axes)`. Outside the grid, the
+    boundary cells are extrapolated.
+    """
+    def __init__(self, axes, values):
+        self.axes = tuple(np.asarray(axis, float) for axis in axes)
+        self.values = _as_table(values)
+        if self.values.shape != tuple(len(axis) for axis in self.axes):
+            raise ValueError('Mismatched grid axes and values shape.')
+        if any(len(axis) < 2 for axis in self.axes):
+            raise ValueError('Every grid axis needs at least 2 points.')
+        self.dim = len(self.axes)
+
+    def _locate(self, points):
+        """Returns, per axis, the cell index and the (A, B, h) weights of the points."""
+        points = np.asarray(points, float)
+        if points.shape[-1] != self.dim:
+            raise ValueError('Expected points of dimension {}.'.format(self.dim))
+        cells = []
+        for k, axis in enumerate(self.axes):
+            x = points[..., k]
+            i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, len(axis) - 2)
+            h = axis[i+1] - axis[i]
+            B = (x - axis[i])/h
+            cells.append((i, 1 - B, B, h))
+        return cells
+
+    def save(self, filename):
+        """Saves the interpolation; reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
+
+@register_proxy
+class LinearGridInterpolation(GridInterpolation):
+    """Multilinear (bilinear, trilinear, ...) interpolation on a grid."""
+
+    def __call__(self, points):
+        cells = self._locate(points)
+        result = 0
+        for corner in product((0, 1), repeat=self.dim):
+            weight = 1
+            index = []
+            for (i, A, B, _), c in zip(cells, corner):
+                weight = weight*(B if c else A)
+                index.append(i + c)
+            result = result + weight*self.values[tuple(index)]
+        return result
+
+    def proxy_arrays(self):
+        arrays = {'axis{}'.format(k): axis for k, axis in enumerate(self.axes)}
+        arrays['values'] = self.values
+        return arrays
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        axes = tuple(arrays['axis{}'.format(k)] for k in range(meta['dim']))
+        return cls(axes, arrays['values'])
+
+    def proxy_meta(self):
+        return {'dim': self.dim}
+
+@register_proxy
+class SplineGridInterpolation(GridInterpolation):
+    """Tensor product natural cubic spline (bicubic, tricubic, ...) on a grid.
+
+    For every subset of axes, the mixed second derivative of the data
+    with respect to those axes is computed once, at construction;
+    evaluation then only reads the 2^dim grid corners of each point's cell.
+    If `folder` is given, those arrays are kept there as memory-mapped
+    .npy files instead of in memory.
+    """
+    def __init__(self, axes, values, folder=None, coefs=None):
+        GridInterpolation.__init__(self, axes, values)
+        if coefs is not None:
+            self.coefs = tuple(coefs)
+            return
+        coefs = [self.values]
+        for mask in range(1, 2**self.dim):
+            # Differentiate the previous subset along the highest axis in this one
+            axis = mask.bit_length() - 1
+            source = coefs[mask ^ (1 << axis)]
+            if folder is None:
+                out = np.empty(self.values.shape)
+            else:
+                out = np.lib.format.open_memmap(
+                    os.path.join(folder, 'coefs{}.npy'.format(mask)), mode='w+',
+                    dtype=float, shape=self.values.shape)
+            _second_derivatives(self.axes[axis], source, axis, out)
+            if folder is not None:
+                out.flush()
+            coefs.append(out)
+        self.coefs = tuple(coefs)
+
+    def __call__(self, points):
+        cells = self._locate(points)
+        # Per axis and corner, the weights of the value and of the 2nd derivative
+        weights = []
+        for i, A, B, h in cells:
+            h2 = h**2/6
+            weights.append(((A, B), ((A**3 - A)*h2, (B**3 - B)*h2)))
+        result = 0
+        for corner in product((0, 1), repeat=self.dim):
+            index = tuple(cell[0] + c for cell, c in zip(cells, corner))
+            for mask, coefs in enumerate(self.coefs):
+                weight = 1
+                for k, c in enumerate(corner):
+                    weight = weight*weights[k][(mask >> k) & 1][c]
+                result = result + weight*coefs[index]
+        return result
+
+    def proxy_arrays(self):
+        arrays = {'axis{}'.format(k): axis for k, axis in enumerate(self.axes)}
+        arrays.update(('coefs{}'.format(mask), coefs) for mask, coefs in enumerate(self.coefs))
+        return arrays
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        axes = tuple(arrays['axis{}'.format(k)] for k in range(meta['dim']))
+        coefs = tuple(arrays['coefs{}'.format(mask)] for mask in range(2**meta['dim']))
+        return cls(axes, coefs[0], coefs=coefs)
+
+    def proxy_meta(self):
+        return {'dim': self.dim}
+
+if __name__ == '__main__':
+    import time
+
+    f = lambda x, y, z: np.sin(x)*np.cos(y)*np.exp(-z)
+    axes = (np.linspace(0, 3, 40), np.linspace(0, 3, 50)**1.5, np.linspace(0, 1, 20))
+    values = f(*np.meshgrid(*axes, indexing='ij'))
+
+    points = np.random.random((10**6, 3))*(3, 3**1.5, 1)
+    exact = f(points[:,0], points[:,1], points[:,2])
+
+    for interpolation in (LinearGridInterpolation, SplineGridInterpolation):
+        start = time.perf_counter()
+        grid = interpolation(axes, values)
+        built = time.perf_counter()
+        result = grid(points)
+        done = time.perf_counter()
+        print('{}: setup {:.3f}s, {} points in {:.3f}s, max. error {:.2E}'.format(
+            interpolation.__name__, built - start, len(points), done - built,
+            np.max(np.abs(result - exact))))
@@ -0,0 +1,273 @@
+# -*- coding:utf-8 -*-
+
+"""Iterative solvers for large (sparse) systems  Ax = b.
+
+A may be a SparseMatrix, a SquareMatrix (converted to SparseMatrix)
+or a dense array; the solvers only need the product `A @ x`, except
+for Gauss-Seidel/SOR and the ILU(0) preconditioner, which need the
+sparse lines.
+
+Every solver returns a tuple (x, residuals), where residuals[k]
+is the relative residual ||b - A x_k|| / ||b|| after k iterations.
+They stop once it is below `tol`, or after `max_iter` iterations.
+"""
+
+from math import hypot
+import numpy as np
+from Folha7Ex3 import SquareMatrix, SparseMatrix
+
+def _as_operator(A):
+    if isinstance(A, SquareMatrix):
+        return A.assparse()
+    if isinstance(A, SparseMatrix):
+        return A
+    return np.asarray(A, float)
+
+def _as_sparse(A):
+    A = _as_operator(A)
+    return A if isinstance(A, SparseMatrix) else SparseMatrix.from_dense(A)
+
+def _diagonal(A):
+    if isinstance(A, SparseMatrix):
+        return A.diagonal()
+    return np.diagonal(A).copy()
+
+def _start(A, b, x0):
+    A = _as_operator(A)
+    b = np.asarray(b, float)
+    x = np.zeros(len(b)) if x0 is None else np.array(x0, float)
+    norm_b = np.linalg.norm(b)
+    return A, b, x, norm_b if norm_b != 0 else 1.0
+
+class _TriangularSweep:
+    """Solves (D + T) x = b, with T the strict lower (or upper) part of A.
+
+    Lines are grouped by dependency level, once; all the lines of a
+    level only depend on previous levels, so each level is solved at
+    once (for stencil matrices there are far fewer levels than lines).
+    """
+    def __init__(self, A : SparseMatrix, diagonal : np.array, lower : bool = True):
+        n = A.shape[0]
+        lines, columns, values = A.tocoo()
+        part = columns < lines if lower else columns > lines
+        lines, columns, values = lines[part], columns[part], values[part]
+        indptr = np.zeros(n + 1, np.intp)
+        np.cumsum(np.bincount(lines, minlength=n), out=indptr[1:])
+        # Dependency levels (sequential, but only done once)
+        level = [0]*n
+        indptr_list, columns_list = indptr.tolist(), columns.tolist()
+        for i in (range(n) if lower else range(n - 1, -1, -1)):
+            deps = columns_list[indptr_list[i]:indptr_list[i+1]]
+            if deps:
+                level[i] = 1 + max(level[j] for j in deps)
+        level = np.array(level, np.intp)
+        # Group lines, and their entries, by level
+        line_order = np.argsort(level, kind='stable')
+        line_bounds = np.concatenate(((0,), np.cumsum(np.bincount(level))))
+        local = np.empty(n, np.intp) # Position of each line within its level
+        local[line_order] = np.arange(n) - np.repeat(line_bounds[:-1], np.diff(line_bounds))
+        entry_order = np.argsort(level[lines], kind='stable')
+        entry_bounds = np.concatenate(((0,), np.cumsum(np.bincount(level[lines], minlength=len(line_bounds) - 1))))
+        self.levels = []
+        for l in range(len(line_bounds) - 1):
+            entries = entry_order[entry_bounds[l]:entry_bounds[l+1]]
+            self.levels.append((
+                line_order[line_bounds[l]:line_bounds[l+1]],
+                local[lines[entries]], columns[entries], values[entries]))
+        self.diagonal = diagonal
+        self.n = n
+
+    def solve(self, b):
+        x = np.zeros(self.n)
+        for rows, local, columns, values in self.levels:
+            rhs = b[rows]
+            if len(columns):
+                rhs = rhs - np.bincount(local, weights=values*x[columns], minlength=len(rows))
+            x[rows] = rhs/self.diagonal[rows]
+        return x
+
+class JacobiPreconditioner:
+    """M = diag(A)."""
+    def __init__(self, A):
+        self.inverse_diagonal = 1/_diagonal(_as_operator(A))
+
+    def __call__(self, r):
+        return self.inverse_diagonal*r
+
+class ILU0Preconditioner:
+    """Incomplete LU factorization with no fill-in: M = L U.
+
+    L and U keep the sparsity pattern of A, which must store
+    every diagonal entry. Indefinite matrices (e.g. A - shift I for
+    an interior shift) can give zero or tiny pivots, and then factors
+    too large to be of any use: ValueError is raised for pivots below
+    `pivot_tolerance` times the largest entry of their line.
+    """
+    def __init__(self, A, pivot_tolerance : float = 1e-3):
+        A = _as_sparse(A)
+        n = A.shape[0]
+        data = A.data.tolist()
+        indices = A.indices.tolist()
+        indptr = A.indptr.tolist()
+        diagonal = [None]*n
+        for i in range(n):
+            for p in range(indptr[i], indptr[i+1]):
+                if indices[p] == i:
+                    diagonal[i] = p
+            if diagonal[i] is None:
+                raise ValueError('ILU(0) needs a stored diagonal (line {}).'.format(i))
+        # IKJ elimination restricted to the pattern of A
+        for i in range(n):
+            position = {indices[p]: p for p in range(indptr[i], indptr[i+1])}
+            scale = max(abs(value) for value in data[indptr[i]:indptr[i+1]])
+            for p in range(indptr[i], diagonal[i]):
+                k = indices[p]
+                data[p] /= data[diagonal[k]]
+                for q in range(diagonal[k] + 1, indptr[k+1]):
+                    if indices[q] in position:
+                        data[position[indices[q]]] -= data[p]*data[q]
+            if abs(data[diagonal[i]]) <= pivot_tolerance*scale:
+                raise ValueError('ILU(0) pivot too small (line {}).'.format(i))
+        factors = SparseMatrix(data, A.indices, A.indptr, A.shape)
+        U_diagonal = factors.data[diagonal]
+        self.L = _TriangularSweep(factors, np.ones(n), lower=True)
+        self.U = _TriangularSweep(factors, U_diagonal, lower=False)
+
+    def __call__(self, r):
+        return self.U.solve(self.L.solve(r))
+
+def jacobi(A, b, x0=None, tol : float = 1e-8, max_iter : int = 10000):
+    """Jacobi iteration,  x <- x + D^-1 (b - A x)."""
+    A, b, x, norm_b = _start(A, b, x0)
+    inverse_diagonal = 1/_diagonal(A)
+    r = b - A @ x
+    residuals = [np.linalg.norm(r)/norm_b]
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        x += inverse_diagonal*r
+        r = b - A @ x
+        residuals.append(np.linalg.norm(r)/norm_b)
+    return x, residuals
+
+def sor(A, b, x0=None, omega : float = 1.0, tol : float = 1e-8, max_iter : int = 10000):
+    """Successive over-relaxation; omega = 1 is Gauss-Seidel.
+
+    Each iteration solves  (D/omega + L) x' = b - (U + (1 - 1/omega) D) x
+    with a sweep over the lower triangle of A.
+    """
+    A = _as_sparse(A)
+    A, b, x, norm_b = _start(A, b, x0)
+    diagonal = A.diagonal()
+    sweep = _TriangularSweep(A, diagonal/omega, lower=True)
+    r = b - A @ x
+    residuals = [np.linalg.norm(r)/norm_b]
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        # (D/omega + L) (x' - x) = b - A x
+        x += sweep.solve(r)
+        r = b - A @ x
+        residuals.append(np.linalg.norm(r)/norm_b)
+    return x, residuals
+
+def cg(A, b, x0=None, tol : float = 1e-8, max_iter : int = None, preconditioner=None):
+    """(Preconditioned) conjugate gradient, for symmetric positive definite A."""
+    A, b, x, norm_b = _start(A, b, x0)
+    if max_iter is None:
+        max_iter = 10*len(b)
+    M = preconditioner if preconditioner is not None else (lambda r: r)
+    r = b - A @ x
+    residuals = [np.linalg.norm(r)/norm_b]
+    z = M(r)
+    p = z.copy()
+    rz = r @ z
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        Ap = A @ p
+        alpha = rz/(p @ Ap)
+        x += alpha*p
+        r -= alpha*Ap
+        residuals.append(np.linalg.norm(r)/norm_b)
+        z = M(r)
+        rz, rz_old = r @ z, rz
+        p = z + (rz/rz_old)*p
+    return x, residuals
+
+def gmres(A, b, x0=None, tol : float = 1e-8, max_iter : int = None, restart : int = 30, preconditioner=None):
+    """Restarted GMRES(restart), right preconditioned.
+
+    Keeps `restart` + 1 basis vectors of length n in memory.
+    """
+    A, b, x, norm_b = _start(A, b, x0)
+    if max_iter is None:
+        max_iter = 10*len(b)
+    M = preconditioner if preconditioner is not None else (lambda r: r)
+    r = b - A @ x
+    residuals = [np.linalg.norm(r)/norm_b]
+    while residuals[-1] > tol and len(residuals) <= max_iter:
+        beta = np.linalg.norm(r)
+        V = np.zeros((restart + 1, len(b)))
+        Z = np.zeros((restart, len(b)))
+        H = np.zeros((restart + 1, restart))
+        cs, sn = np.zeros(restart), np.zeros(restart)
+        g = np.zeros(restart + 1)
+        g[0] = beta
+        V[0] = r/beta
+        for k in range(restart):
+            # Arnoldi step (modified Gram-Schmidt)
+            Z[k] = M(V[k])
+            w = A @ Z[k]
+            for i in range(k + 1):
+                H[i,k] = w @ V[i]
+                w -= H[i,k]*V[i]
+            H[k+1,k] = np.linalg.norm(w)
+            breakdown = H[k+1,k] == 0 # Exact solution in this subspace
+            if not breakdown:
+                V[k+1] = w/H[k+1,k]
+            # Keep H triangular with Givens rotations
+            for i in range(k):
+                H[i,k], H[i+1,k] = cs[i]*H[i,k] + sn[i]*H[i+1,k], -sn[i]*H[i,k] + cs[i]*H[i+1,k]
+            denominator = hypot(H[k,k], H[k+1,k])
+            cs[k], sn[k] = H[k,k]/denominator, H[k+1,k]/denominator
+            H[k,k], H[k+1,k] = denominator, 0
+            g[k], g[k+1] = cs[k]*g[k], -sn[k]*g[k]
+            residuals.append(abs(g[k+1])/norm_b)
+            if residuals[-1] <= tol or len(residuals) > max_iter or breakdown:
+                break
+        # Least squares solution of the small triangular system
+        m = k + 1
+        y = np.zeros(m)
+        for i in range(m - 1, -1, -1):
+            y[i] = (g[i] - H[i,i+1:m] @ y[i+1:])/H[i,i]
+        x += Z[:m].T @ y
+        r = b - A @ x
+        residuals[-1] = np.linalg.norm(r)/norm_b
+    return x, residuals
+
+if __name__ == '__main__':
+    import time
+
+    # 2D Poisson problem (5 point stencil) on an N x N grid
+    N = 100
+    n = N*N
+    index = np.arange(n).reshape(N, N)
+    lines, columns, values = [index.ravel()], [index.ravel()], [np.full(n, 4.0)]
+    for this, other in ((index[1:], index[:-1]), (index[:, 1:], index[:, :-1])):
+        lines += [this.ravel(), other.ravel()]
+        columns += [other.ravel(), this.ravel()]
+        values += [np.full(this.size, -1.0)]*2
+    A = SparseMatrix.from_coo(np.concatenate(lines), np.concatenate(columns), np.concatenate(values), (n, n))
+    b = np.ones(n)
+
+    runs = (
+        ('Jacobi', lambda: jacobi(A, b, tol=1e-6, max_iter=2000)),
+        ('Gauss-Seidel', lambda: sor(A, b, tol=1e-6, max_iter=2000)),
+        ('SOR (omega=1.9)', lambda: sor(A, b, omega=1.9, tol=1e-6, max_iter=2000)),
+        ('CG', lambda: cg(A, b, tol=1e-6)),
+        ('CG + Jacobi', lambda: cg(A, b, tol=1e-6, preconditioner=JacobiPreconditioner(A))),
+        ('CG + ILU(0)', lambda: cg(A, b, tol=1e-6, preconditioner=ILU0Preconditioner(A))),
+        ('GMRES(30)', lambda: gmres(A, b, tol=1e-6, max_iter=2000)),
+        ('GMRES(30) + ILU(0)', lambda: gmres(A, b, tol=1e-6, preconditioner=ILU0Preconditioner(A))),
+    )
+    print('Poisson problem, {} unknowns'.format(n))
+    for name, run in runs:
+        start = time.perf_counter()
+        x, residuals = run()
+        print('{:<20} {:>6} iterations, {:8.3f}s, residual {:.2E}'.format(
+            name, len(residuals) - 1, time.perf_counter() - start, np.linalg.norm(b - A @ x)/np.linalg.norm(b)))
@@ -0,0 +1,473 @@
+# -*- coding:utf-8 -*-
+
+"""Incremental least squares polynomial fits, for data that does not fit in memory.
+
+Points are consumed in chunks (from arrays, generators or text
+files, see `read_points`), and only a (deg + 1) x (deg + 1) state is
+kept, so memory use does not depend on the number of points:
+
+- `MomentLeastSquares` accumulates the normal equations (the moment
+  matrix V^T V and V^T y); cheapest, but squares the condition number.
+- `Folha9Ex1.QRLeastSquares` accumulates the R factor of V by
+  Householder reflections; use it for high degrees.
+- `RecursiveLeastSquares` keeps the coefficients themselves up to
+  date as each new point arrives (O(deg^2) per point).
+- `DegreeSelection` fits every degree up to a maximum at once, with
+  information criteria and cross-validation, for model selection.
+- `LinearRegression` is weighted least squares for any design matrix
+  (see `design_matrix`), with parameter covariances and errors.
+
+The first two can be merged, so chunks may be accumulated in
+separate processes (the accumulators pickle as plain arrays) and
+combined at the end.
+"""
+
+from math import lgamma, exp, log
+import numpy as np
+from Folha7Ex1 import solve
+from Folha7Ex2 import LUFactorization
+from Folha9Ex1 import (CHUNK_SIZE, PolynomialFit, QRLeastSquares, basis_matrix,
+    householder_fold, upper_solve, _normal_equations, _to_domain)
+from Folha8Ex1 import ErrorValue
+from matrix_io import iter_text_matrix
+from proxy_io import register_proxy, save_proxy
+
+class MomentLeastSquares:
+    """Least squares polynomial fit from accumulated normal equations.
+
+    Keeps A = V^T V, b = V^T y and y^T y. With a `domain` (a, b),
+    x is mapped onto [-1, 1] first (as in `QRLeastSquares`), which
+    keeps A much better conditioned than for raw x.
+    """
+    def __init__(self, deg : int, domain=None):
+        self.deg = deg
+        self.basis = 'monomial'
+        self.domain = None if domain is None else tuple(float(bound) for bound in domain)
+        self.A = np.zeros((deg + 1, deg + 1))
+        self.b = np.zeros(deg + 1)
+        self.yy = 0.0
+        self.count = 0
+
+    def add(self, x, y):
+        """Adds the points (x, y)."""
+        y = np.asarray(y, float)
+        A, b = _normal_equations(_to_domain(x, self.domain), y, self.deg)
+        self.A += A
+        self.b += b
+        self.yy += y @ y
+        self.count += len(y)
+        return self
+
+    def merge(self, other):
+        """Adds the points of another MomentLeastSquares (same deg and domain)."""
+        if (other.deg, other.domain) != (self.deg, self.domain):
+            raise ValueError('Cannot merge fits of different degree or domain.')
+        self.A += other.A
+        self.b += other.b
+        self.yy += other.yy
+        self.count += other.count
+        return self
+
+    def solve(self) -> np.array:
+        return solve(self.A, self.b[:, None])[:, 0]
+
+    @property
+    def rss(self):
+        """Residual sum of squares of the current solution."""
+        coefs = self.solve()
+        return max(0.0, self.yy - 2*coefs @ self.b + coefs @ self.A @ coefs)
+
+    def fit(self):
+        return PolynomialFit(self.solve(), self.basis, self.domain)
+
+class RecursiveLeastSquares:
+    """Recursive least squares: the fit is updated as each point arrives.
+
+    Keeps the coefficients and P = (V^T V)^-1, updating both in
+    O(deg^2) per point (Sherman-Morrison), with no refactoring.
+    A `forgetting` factor below 1 weighs older points down
+    exponentially, for drifting data.
+    Start either from scratch, with P = `delta` I (a large delta is a
+    weak prior towards zero coefficients), or from an accumulated fit
+    with `from_accumulator`.
+    """
+    def __init__(self, deg : int, basis : str = 'monomial', domain=None,
+                 forgetting : float = 1.0, delta : float = 1e8):
+        if basis == 'legendre' and domain is None:
+            raise ValueError('The Legendre basis needs a domain.')
+        self.deg, self.basis = deg, basis
+        self.domain = None if domain is None else tuple(float(bound) for bound in domain)
+        self.forgetting = forgetting
+        self.coefs = np.zeros(deg + 1)
+        self.P = delta*np.identity(deg + 1)
+        self.count = 0
+
+    @classmethod
+    def from_accumulator(cls, accumulator, forgetting : float = 1.0):
+        """Continues a MomentLeastSquares or QRLeastSquares fit point by point."""
+        rls = cls(accumulator.deg, accumulator.basis, accumulator.domain, forgetting)
+        if isinstance(accumulator, QRLeastSquares):
+            # (R^T R)^-1 = R^-1 R^-T
+            R_inverse = LUFactorization(accumulator.R).inverse()
+            rls.P = R_inverse @ R_inverse.T
+        else:
+            rls.P = LUFactorization(accumulator.A).inverse()
+        rls.coefs = accumulator.solve()
+        rls.count = accumulator.count
+        return rls
+
+    def add(self, x, y):
+        """Updates the fit with the points (x, y), one at a time."""
+        y = np.asarray(y, float)
+        V = basis_matrix(_to_domain(np.atleast_1d(x), self.domain), self.deg, self.basis)
+        P, coefs, forgetting = self.P, self.coefs, self.forgetting
+        for phi, value in zip(V, np.atleast_1d(y)):
+            P_phi = P @ phi
+            gain = P_phi/(forgetting + phi @ P_phi)
+            coefs += gain*(value - phi @ coefs)
+            P -= np.outer(gain, P_phi)
+            if forgetting != 1:
+                P /= forgetting
+        self.count += len(V)
+        return self
+
+    def solve(self) -> np.array:
+        return self.coefs.copy()
+
+    def fit(self):
+        return PolynomialFit(self.solve(), self.basis, self.domain)
+
+class DegreeSelection:
+    """Least squares fits of every degree 0 ... `max_deg`, from one pass over the points.
+
+    The design matrix of degree d is the first d + 1 columns of that
+    of `max_deg`, so a single QR (see `QRLeastSquares`) holds every
+    fit: its leading (d + 1) x (d + 1) block of R and Q^T y give the
+    coefficients, and the residual sum of squares is
+        rss_d = rss_max_deg + sum(qty[d+1:]^2).
+    For `folds`-fold cross-validation, point u goes to fold u % folds
+    and each fold keeps its own QR; the error of a fit c over a fold
+    is ||R_fold c - qty_fold||^2 + rss_fold, so no point is needed twice.
+    """
+    def __init__(self, max_deg : int, basis : str = 'legendre', domain=None, folds : int = 5):
+        self.max_deg = max_deg
+        self.folds = [QRLeastSquares(max_deg, basis, domain) for _ in range(max(1, folds))]
+        self.count = 0
+
+    def add(self, x, y):
+        """Adds the points (x, y)."""
+        x = np.asarray(x, float)
+        y = np.asarray(y, float)
+        k = len(self.folds)
+        for fold, accumulator in enumerate(self.folds):
+            part = slice((fold - self.count) % k, None, k)
+            accumulator.add(x[part], y[part])
+        self.count += len(x)
+        return self
+
+    def merge(self, other):
+        """Adds the points of another DegreeSelection (same settings)."""
+        if len(other.folds) != len(self.folds):
+            raise ValueError('Cannot merge selections with different folds.')
+        for accumulator, other_accumulator in zip(self.folds, other.folds):
+            accumulator.merge(other_accumulator)
+        self.count += other.count
+        return self
+
+    def _combined(self, exclude=None):
+        first = self.folds[0]
+        combined = QRLeastSquares(self.max_deg, first.basis, first.domain)
+        for fold, accumulator in enumerate(self.folds):
+            if fold != exclude:
+                combined.merge(accumulator)
+        return combined
+
+    @staticmethod
+    def _coefs(accumulator, deg):
+        """Degree `deg` coefficients from the leading block of R (None if singular)."""
+        R = accumulator.R[:deg + 1, :deg + 1]
+        if np.any(np.diagonal(R) == 0):
+            return None
+        return upper_solve(R, accumulator.qty[:deg + 1])
+
+    def results(self):
+        """Per degree, a dict with the `fit` (a PolynomialFit), `rss`, `aic`, `bic` and `cv`.
+
+        aic = n ln(rss/n) + 2k and bic = n ln(rss/n) + k ln(n), k = deg + 1;
+        cv is the mean squared error on held-out folds (nan for 1 fold).
+        """
+        total = self._combined()
+        n = total.count
+        trained = [self._combined(exclude=fold) for fold in range(len(self.folds))] if len(self.folds) > 1 else []
+        results = []
+        for deg in range(self.max_deg + 1):
+            coefs = self._coefs(total, deg)
+            if coefs is None or n <= deg + 1:
+                results.append({'deg': deg, 'fit': None, 'rss': np.nan, 'aic': np.inf, 'bic': np.inf, 'cv': np.inf})
+                continue
+            rss = total.rss + np.sum(total.qty[deg + 1:]**2)
+            k = deg + 1
+            log_likelihood_term = n*np.log(max(rss, np.finfo(float).tiny)/n)
+            cv = np.nan
+            if trained:
+                errors = 0.0
+                for fold, training in enumerate(trained):
+                    fold_coefs = self._coefs(training, deg)
+                    if fold_coefs is None:
+                        errors = np.inf
+                        break
+                    held_out = self.folds[fold]
+                    residual = held_out.R[:, :deg + 1] @ fold_coefs - held_out.qty
+                    errors += residual @ residual + held_out.rss
+                cv = errors/n
+            results.append({
+                'deg': deg,
+                'fit': PolynomialFit(coefs, total.basis, total.domain),
+                'rss': rss,
+                'aic': log_likelihood_term + 2*k,
+                'bic': log_likelihood_term + k*np.log(n),
+                'cv': cv,
+            })
+        return results
+
+    def best(self, criterion : str = 'bic'):
+        """The result (see `results`) minimizing `criterion`: 'aic', 'bic' or 'cv'."""
+        if criterion not in ('aic', 'bic', 'cv'):
+            raise ValueError("`criterion` should be 'aic', 'bic' or 'cv'.")
+        return min(self.results(), key=lambda result: result[criterion])
+
+def fit_all_degrees(x, y, max_deg : int, basis : str = 'legendre', domain=None, folds : int = 5):
+    """`DegreeSelection` of the points (x, y); the domain defaults to the range of x."""
+    x = np.asarray(x, float)
+    if domain is None and basis == 'legendre':
+        domain = (np.min(x), np.max(x))
+        if domain[0] == domain[1]:
+            domain = (domain[0] - 1, domain[1] + 1)
+    return DegreeSelection(max_deg, basis, domain, folds).add(x, y)
+
+def _incomplete_beta(a, b, x):
+    """Regularized incomplete beta function I_x(a, b) (continued fraction)."""
+    if x <= 0 or x >= 1:
+        return float(x >= 1)
+    front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a*log(x) + b*log(1 - x))
+    if x > (a + 1)/(a + b + 2):
+        return 1 - _incomplete_beta(b, a, 1 - x)
+    # Lentz's method
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b)*x/(a + 1)
+    d = 1/(d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (m*(b - m)*x/((a + 2*m - 1)*(a + 2*m)),
+                          -(a + m)*(a + b + m)*x/((a + 2*m)*(a + 2*m + 1))):
+            d = 1 + numerator*d
+            d = 1/(d if abs(d) > tiny else tiny)
+            c = 1 + numerator/c
+            c = c if abs(c) > tiny else tiny
+            result *= c*d
+        if abs(c*d - 1) < 1e-15:
+            break
+    return front*result/a
+
+def t_critical(confidence : float, dof : int) -> float:
+    """Two-sided critical value of Student's t: P(|T| <= t) = confidence."""
+    if not 0 < confidence < 1 or dof <= 0:
+        raise ValueError('Need 0 < confidence < 1 and dof > 0.')
+    tail = lambda t: _incomplete_beta(dof/2, 0.5, dof/(dof + t*t)) # P(|T| > t)
+    low, high = 0.0, 1.0
+    while tail(high) > 1 - confidence:
+        high *= 2
+    for _ in range(100):
+        middle = (low + high)/2
+        low, high = (middle, high) if tail(middle) > 1 - confidence else (low, middle)
+    return (low + high)/2
+
+def design_matrix(*columns, intercept : bool = True) -> np.array:
+    """Design matrix X from regressors or basis functions already evaluated on the points.
+
+    E.g. design_matrix(x1, x2, x1*x2, np.log(x3)); a column of ones
+    comes first with `intercept`. 2D arguments add all their columns.
+    """
+    columns = [np.asarray(column, float) for column in columns]
+    n = len(columns[0]) if columns else 0
+    blocks = ([np.ones((n, 1))] if intercept else []) + [
+        column.reshape(n, -1) for column in columns]
+    return np.concatenate(blocks, axis=1)
+
+@register_proxy
+class LinearRegression:
+    """Weighted least squares,  y ~ X @ params,  for any design matrix X.
+
+    Minimizes sum(w (y - X @ params)^2), folding the rows (scaled by
+    sqrt(w)) into a Householder R factor as `QRLeastSquares` does, so
+    rows may be added in chunks and accumulators merged. Weights are
+    relative unless `absolute_weights` (w = 1/sigma^2): by default the
+    covariance is scaled by the weighted residual variance.
+    """
+    def __init__(self, n_params : int, absolute_weights : bool = False):
+        self.n_params = n_params
+        self.absolute_weights = absolute_weights
+        self.R = np.zeros((n_params, n_params))
+        self.qty = np.zeros(n_params)
+        self.rss = 0.0 # Weighted residual sum of squares
+        self.count = 0
+        # Weighted sums of 1, y and y^2, for r^2
+        self.sums = np.zeros(3)
+
+    def add(self, X, y, weights=None):
+        """Adds the rows X (shape (N, n_params)) with values y and optional weights."""
+        X = np.array(X, float)
+        if X.ndim == 1:
+            X = X[:, None]
+        y = np.array(y, float)
+        if X.shape != (len(y), self.n_params):
+            raise ValueError('Expected a design matrix of shape ({}, {}).'.format(len(y), self.n_params))
+        weights = np.ones(len(y)) if weights is None else np.asarray(weights, float)
+        if weights.shape != y.shape:
+            raise ValueError('Expected {} weights, one per point.'.format(len(y)))
+        if np.any(weights < 0):
+            raise ValueError('Weights cannot be negative.')
+        self.sums += (np.sum(weights), weights @ y, weights @ y**2)
+        root = np.sqrt(weights)
+        for start in range(0, len(y), CHUNK_SIZE):
+            part = slice(start, start + CHUNK_SIZE)
+            self.rss += householder_fold(self.R, self.qty, X[part]*root[part, None], y[part]*root[part])
+        self.count += len(y)
+        return self
+
+    def merge(self, other):
+        """Adds the rows of another LinearRegression (same n_params and weighting)."""
+        if (other.n_params, other.absolute_weights) != (self.n_params, self.absolute_weights):
+            raise ValueError('Cannot merge regressions with different parameters or weighting.')
+        self.rss += householder_fold(self.R, self.qty, other.R.copy(), other.qty.copy()) + other.rss
+        self.count += other.count
+        self.sums += other.sums
+        return self
+
+    def solve(self) -> np.array:
+        """The parameters."""
+        return upper_solve(self.R, self.qty)
+
+    @property
+    def dof(self):
+        return self.count - self.n_params
+
+    @property
+    def residual_variance(self):
+        """Weighted residual sum of squares over the degrees of freedom."""
+        return self.rss/self.dof if self.dof > 0 else np.nan
+
+    @property
+    def r_squared(self):
+        total = self.sums[2] - self.sums[1]**2/self.sums[0]
+        return 1 - self.rss/total if total > 0 else np.nan
+
+    def covariance(self) -> np.array:
+        """Parameter covariance matrix, s^2 (X^T W X)^-1 = s^2 R^-1 R^-T."""
+        R_inverse = upper_solve(self.R, np.identity(self.n_params))
+        covariance = R_inverse @ R_inverse.T
+        return covariance if self.absolute_weights else self.residual_variance*covariance
+
+    def standard_errors(self) -> np.array:
+        return np.sqrt(np.diagonal(self.covariance()))
+
+    def error_values(self, confidence : float = 0.95):
+        """Parameters as `ErrorValue`s, with errors the half-width of their
+        `confidence` intervals (Student's t, dof degrees of freedom);
+        with no confidence, the standard errors."""
+        errors = self.standard_errors()
+        if confidence is not None:
+            errors = errors*t_critical(confidence, self.dof)
+        return [ErrorValue(value, error) for value, error in zip(self.solve(), errors)]
+
+    def proxy_arrays(self):
+        return {'R': self.R, 'qty': self.qty, 'sums': self.sums}
+
+    def proxy_meta(self):
+        return {'absolute_weights': self.absolute_weights, 'rss': float(self.rss), 'count': int(self.count)}
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        regression = cls(len(arrays['qty']), meta['absolute_weights'])
+        regression.R[:] = arrays['R']
+        regression.qty[:] = arrays['qty']
+        regression.sums[:] = arrays['sums']
+        regression.rss, regression.count = meta['rss'], meta['count']
+        return regression
+
+    def save(self, filename):
+        """Saves the accumulated regression; reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
+
+def linear_regression(X, y, weights=None, absolute_weights : bool = False):
+    """`LinearRegression` of y on the design matrix X (see `design_matrix`)."""
+    X = np.asarray(X, float)
+    n_params = 1 if X.ndim == 1 else X.shape[1]
+    return LinearRegression(n_params, absolute_weights).add(X, y, weights)
+
+def read_points(file, columns=(0, 1), chunk_size : int = CHUNK_SIZE*64):
+    """Yields (x, y) chunks from a whitespace separated text file.
+
+    `columns` are the indices of the x and y columns (the others are
+    not converted, and may hold anything); about `chunk_size`
+    characters are read at a time.
+    """
+    for chunk in iter_text_matrix(file, chunk_size, usecols=columns):
+        if len(chunk):
+            yield chunk[:, 0], chunk[:, 1]
+
+def accumulate(accumulator, chunks):
+    """Adds every (x, y) chunk (e.g. from `read_points`) to the accumulator."""
+    for x, y in chunks:
+        accumulator.add(x, y)
+    return accumulator
+
+if __name__ == '__main__':
+    import os
+    import time
+    import tempfile
+
+    # A large observation log, written and then fitted a chunk at a time
+    n = 5*10**6
+    f = lambda x: 1 + 0.5*x - 0.02*x**3
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'log.dat')
+        with open(filename, 'w') as file:
+            for start in range(0, n, 10**6):
+                x = np.random.random(10**6)*10
+                np.savetxt(file, np.column_stack((x, f(x) + np.random.standard_normal(10**6))), fmt='%.9g')
+        print('Observation log: {:.0f} MB'.format(os.path.getsize(filename)/2**20))
+
+        for accumulator in (MomentLeastSquares(3, (0, 10)), QRLeastSquares(3, 'legendre', (0, 10))):
+            start = time.perf_counter()
+            fit = accumulate(accumulator, read_points(filename)).fit()
+            x = np.linspace(0, 10, 11)
+            print('{}: {:.3f}s, {} points, max. error {:.2E}'.format(
+                type(accumulator).__name__, time.perf_counter() - start, accumulator.count,
+                np.max(np.abs(fit(x) - f(x)))))
+
+    # Separate accumulators, merged
+    x = np.random.random(10**6)*10
+    y = f(x) + np.random.standard_normal(10**6)
+    halves = [QRLeastSquares(3, 'legendre', (0, 10)).add(x[part], y[part]) for part in (slice(None, 500000), slice(500000, None))]
+    whole = QRLeastSquares(3, 'legendre', (0, 10)).add(x, y)
+    print('Merged vs. whole: {:.2E}'.format(np.max(np.abs(halves[0].merge(halves[1]).solve() - whole.solve()))))
+
+    # New points arriving one by one
+    rls = RecursiveLeastSquares.from_accumulator(whole)
+    x_new = np.random.random(1000)*10
+    y_new = f(x_new) + np.random.standard_normal(1000)
+    start = time.perf_counter()
+    for xi, yi in zip(x_new, y_new):
+        rls.add(xi, yi)
+    print('RLS, 1000 updates: {:.3f}s, vs. refit {:.2E}'.format(
+        time.perf_counter() - start, np.max(np.abs(rls.solve() - whole.add(x_new, y_new).solve()))))
+
+    # Every degree up to 10 from one pass
+    start = time.perf_counter()
+    selection = fit_all_degrees(x, y, 10)
+    results = selection.results()
+    print('Degrees 0-10, one pass over {} points: {:.3f}s'.format(len(x), time.perf_counter() - start))
+    for result in results:
+        print('  deg {deg:2}: rss {rss:.6E}  aic {aic:.3f}  bic {bic:.3f}  cv {cv:.6f}'.format(**result))
+    print('Best by BIC: degree', selection.best('bic')['deg'])
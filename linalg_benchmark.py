@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+
+"""Times the linear algebra routines of the Folhas for a few matrix sizes.
+
+Usage:
+    python linalg_benchmark.py [--sizes 100 500 2000] [--repeat 3] [routine ...]
+Prints the best time out of `repeat` runs for every routine and size.
+"""
+
+import time
+import numpy as np
+
+from Folha6Ex1 import get_inverse
+from Folha7Ex1 import solve
+from Folha7Ex2 import LU, LUFactorization
+
+def random_system(n, seed=0):
+    """A well conditioned (diagonally dominant) n x n system A, b."""
+    rng = np.random.default_rng(seed)
+    A = rng.random((n, n)) + n*np.identity(n)
+    b = rng.random((n, 1))
+    return A, b
+
+# name -> function(A, b) timed on each system
+ROUTINES = {
+    'Folha7Ex1.solve': lambda A, b: solve(np.matrix(A), np.matrix(b)),
+    'Folha7Ex2.LU': lambda A, b: LU(np.matrix(A)),
+    'LUFactorization': lambda A, b: LUFactorization(A),
+    'LUFactorization.solve': lambda A, b: LUFactorization(A).solve(b),
+    'Folha6Ex1.get_inverse': lambda A, b: get_inverse(list(A)),
+}
+
+def benchmark(routine, n, repeat):
+    A, b = random_system(n)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        routine(A, b)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks the linear algebra routines.')
+    parser.add_argument('routines', nargs='*', help='Routines to time (all by default)',
+        default=list(ROUTINES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 500, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:<28}'.format('routine') + ''.join('{:>12}'.format('n={}'.format(n)) for n in args.sizes))
+    for name in args.routines:
+        times = (benchmark(ROUTINES[name], n, args.repeat) for n in args.sizes)
+        print('{:<28}'.format(name) + ''.join('{:>11.4f}s'.format(t) for t in times), flush=True)
@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+
+"""Reading and writing matrices and vectors in bulk.
+
+Text files are whitespace separated numbers, one matrix line per
+file line; they are parsed a chunk at a time, by numpy, with no
+Python work per element. Binary files are .npy, opened memory-mapped.
+Sparse matrices use a triplet text format:
+    n_lines n_columns nnz
+    i j value
+    ...
+with 0-based i, j.
+
+Text parsing is bound by np.fromstring, about 25 MB/s on a single
+slow core. A 20000 x 20000 matrix (7.45 GB as %.17g text) streamed
+through `iter_text_matrix` in 280 s there. Its .npy (3.2 GB) was read
+whole in 51 s from a cold cache and memory-mapped in 2 ms, so keep
+large systems as .npy.
+"""
+
+import warnings
+import numpy as np
+
+CHUNK_SIZE = 2**24 # Characters parsed at once
+
+def _fromstring(text):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except (DeprecationWarning, ValueError):
+            # (numpy < 2 warns, numpy >= 2 raises its own ValueError)
+            raise ValueError('Could not parse matrix file (non numeric data?).') from None
+
+def _parse(text, columns):
+    """Parses whitespace separated numbers, complaining about anything else.
+
+    With `columns`, every non empty line must have that many numbers.
+    """
+    if text.isspace() or text == '':
+        return np.zeros(0) # (np.fromstring gives [-1.] here)
+    if not columns:
+        return _fromstring(text)
+    if 'n' in text or 'N' in text:
+        # nan or inf in the data: count the numbers of each line by hand
+        values = _fromstring(text)
+        lengths = np.array([len(line.split()) for line in text.splitlines()])
+    else:
+        # A nan after each line marks where it ends, in the same parse
+        marked = text.replace('\n', ' nan\n') + ('' if text.endswith('\n') else ' nan')
+        values = _fromstring(marked)
+        ends = np.isnan(values)
+        lengths = np.diff(np.flatnonzero(ends), prepend=-1) - 1
+        values = values[~ends]
+    if np.any((lengths != columns) & (lengths != 0)):
+        raise ValueError('Matrix file lines have different lengths.')
+    return values
+
+def _parse_columns(text, usecols):
+    """Parses the `usecols` columns of whitespace separated lines (np.loadtxt,
+    so other columns may hold anything, e.g. names)."""
+    if text.isspace() or text == '':
+        return np.zeros((0, len(usecols)))
+    try:
+        return np.loadtxt(text.splitlines(), usecols=usecols, comments=None, ndmin=2)
+    except ValueError:
+        raise ValueError('Could not parse matrix file columns {} (non numeric data or short lines?).'.format(
+            tuple(usecols))) from None
+
+def read_text_matrix(file, chunk_size : int = CHUNK_SIZE, usecols=None) -> np.array:
+    """Reads a whitespace separated text matrix into a 2D array.
+
+    `file` is a file name or an open text file, which is read
+    from its current position to the end. With `usecols`, only
+    those columns are read.
+    """
+    chunks = list(iter_text_matrix(file, chunk_size, usecols))
+    if not chunks:
+        return np.zeros((0, 0 if usecols is None else len(usecols)))
+    return np.concatenate(chunks)
+
+def iter_text_matrix(file, chunk_size : int = CHUNK_SIZE, usecols=None):
+    """Yields a whitespace separated text matrix as 2D arrays of consecutive lines.
+
+    Reads about `chunk_size` characters at a time, so memory use does
+    not depend on the size of the file; see `read_text_matrix`.
+    With `usecols` (a sequence of column indices), only those columns
+    are converted and the others may hold anything.
+    """
+    if isinstance(file, str):
+        with open(file) as opened:
+            yield from iter_text_matrix(opened, chunk_size, usecols)
+        return
+    # Number of columns from the first non empty line
+    first = ''
+    while first.strip() == '':
+        first = file.readline()
+        if first == '':
+            return
+    if usecols is None:
+        columns = len(first.split())
+        parse = lambda text: _parse(text, columns).reshape(-1, columns)
+    else:
+        parse = lambda text: _parse_columns(text, usecols)
+    yield parse(first)
+    remainder = ''
+    while True:
+        text = file.read(chunk_size)
+        if text == '':
+            break
+        # Only parse whole lines; keep the rest for the next chunk
+        text = remainder + text
+        cut = text.rfind('\n') + 1
+        text, remainder = text[:cut], text[cut:]
+        yield parse(text)
+    yield parse(remainder)
+
+def write_text_matrix(file, matrix):
+    """Writes a 2D array (or a vector, as a line) as whitespace separated text."""
+    np.savetxt(file, np.atleast_2d(matrix), fmt='%.17g')
+
+def read_system(file):
+    """Reads a system  Ax = b  in the Folha6Ex1 format: b on the first line, then A.
+
+    Returns (A, b), as a 2D and a 1D array.
+    """
+    if isinstance(file, str):
+        with open(file) as opened:
+            return read_system(opened)
+    b = _parse(file.readline(), 0)
+    return read_text_matrix(file), b
+
+def save_matrix(filename, matrix):
+    """Saves a dense matrix (or vector) as .npy."""
+    np.save(filename, np.asarray(matrix))
+
+def load_matrix(filename, mmap : bool = True):
+    """Loads a .npy matrix; memory-mapped read only, unless `mmap` is False."""
+    return np.load(filename, mmap_mode='r' if mmap else None)
+
+def save_triplets(filename, matrix):
+    """Saves a SparseMatrix or SquareMatrix in the triplet format."""
+    from Folha7Ex3 import SquareMatrix
+    if isinstance(matrix, SquareMatrix):
+        matrix = matrix.assparse()
+    lines, columns, values = matrix.tocoo()
+    with open(filename, 'w') as file:
+        file.write('{} {} {}\n'.format(matrix.shape[0], matrix.shape[1], matrix.nnz))
+        table = np.empty(matrix.nnz, dtype=[('i', np.intp), ('j', np.intp), ('value', float)])
+        table['i'], table['j'], table['value'] = lines, columns, values
+        np.savetxt(file, table, fmt=('%d', '%d', '%.17g'))
+
+def load_triplets(filename):
+    """Loads a triplet file as a SparseMatrix (see `SparseMatrix.assquarematrix`)."""
+    from Folha7Ex3 import SparseMatrix
+    with open(filename) as file:
+        shape = tuple(int(x) for x in file.readline().split()[:2])
+        table = read_text_matrix(file)
+    if table.size == 0:
+        table = np.zeros((0, 3))
+    return SparseMatrix.from_coo(table[:,0].astype(np.intp), table[:,1].astype(np.intp), table[:,2], shape)
+
+if __name__ == '__main__':
+    import os
+    import time
+    import tempfile
+
+    n = 2000
+    A = np.random.random((n, n))
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'matrix.txt')
+        write_text_matrix(filename, A)
+        start = time.perf_counter()
+        B = read_text_matrix(filename)
+        print('Text {}x{} ({:.0f} MB) read in {:.3f}s, equal: {}'.format(
+            n, n, os.path.getsize(filename)/2**20, time.perf_counter() - start, np.array_equal(A, B)))
+
+        filename = os.path.join(folder, 'matrix.npy')
+        save_matrix(filename, A)
+        start = time.perf_counter()
+        B = load_matrix(filename)
+        print('Binary opened in {:.4f}s, equal: {}'.format(time.perf_counter() - start, np.array_equal(A, B)))
+
+        from Folha7Ex3 import SparseMatrix
+        S = SparseMatrix.from_dense(A*(A < 0.01))
+        filename = os.path.join(folder, 'matrix.triplets')
+        save_triplets(filename, S)
+        T = load_triplets(filename)
+        print('Triplets: {}, equal: {}'.format(T, np.array_equal(S.asnumpy(), T.asnumpy())))
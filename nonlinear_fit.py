@@ -0,0 +1,240 @@
+# -*- coding:utf-8 -*-
+
+"""Nonlinear least squares (Levenberg-Marquardt), one curve or many at once.
+
+The model is a function `model(x, *params)` written with numpy
+operations, e.g.
+    decay = lambda t, A, k: A*np.exp(-k*t)
+and is always called on whole arrays: in batch mode every parameter
+is a (K, 1) column, one value per curve, so a single call evaluates
+all K curves. Each iteration solves the K damped least squares
+problems
+    [J; sqrt(lambda D)] step ~ [r; 0],   D = diag(J^T J)
+together, by Householder QR (Folha9Ex1.householder_fold), without
+forming J^T J; every curve adapts its own lambda and stops on its own.
+"""
+
+import numpy as np
+from Folha9Ex1 import householder_fold, upper_solve
+from Folha8Ex1 import ErrorValue
+from least_squares import t_critical
+from proxy_io import register_proxy, save_proxy
+
+@register_proxy
+class NonlinearFit:
+    """Result of `levenberg_marquardt`.
+
+    `params` has shape (p,), or (K, p) in batch mode, and
+    `covariance` (p, p) or (K, p, p); `chi2` is the weighted residual
+    sum of squares and `dof` = N - p. `converged` and `iterations`
+    are per curve in batch mode.
+    The model function is not saved (see `save`): a loaded fit has
+    `model` None until it is set again.
+    """
+    def __init__(self, model, params, covariance, chi2, dof, iterations, converged):
+        self.model = model
+        self.params = params
+        self.covariance = covariance
+        self.chi2 = chi2
+        self.dof = dof
+        self.iterations = iterations
+        self.converged = converged
+
+    def __call__(self, x):
+        """The fitted model at x (one line per curve in batch mode)."""
+        if self.model is None:
+            raise ValueError('This fit has no model (it was loaded); set `model` first.')
+        params = np.atleast_2d(self.params)
+        result = self.model(np.asarray(x, float), *(params.T[:, :, None]))
+        return result if np.ndim(self.params) > 1 else result[0]
+
+    def standard_errors(self):
+        return np.sqrt(np.diagonal(self.covariance, axis1=-2, axis2=-1))
+
+    def error_values(self, confidence : float = 0.95):
+        """Parameters as `ErrorValue`s (a list per curve in batch mode), with errors
+        the half-width of their `confidence` intervals; with no confidence,
+        the standard errors."""
+        errors = self.standard_errors()
+        if confidence is not None:
+            errors = errors*t_critical(confidence, self.dof)
+        if np.ndim(self.params) == 1:
+            return [ErrorValue(value, error) for value, error in zip(self.params, errors)]
+        return [[ErrorValue(value, error) for value, error in zip(line, line_errors)]
+                for line, line_errors in zip(self.params, errors)]
+
+    def proxy_arrays(self):
+        return {'params': self.params, 'covariance': self.covariance, 'chi2': np.asarray(self.chi2),
+                'iterations': np.asarray(self.iterations), 'converged': np.asarray(self.converged)}
+
+    def proxy_meta(self):
+        return {'dof': int(self.dof)}
+
+    @classmethod
+    def from_proxy(cls, arrays, meta):
+        unwrap = lambda array: array[()] if array.ndim == 0 else array
+        return cls(None, arrays['params'], arrays['covariance'], unwrap(arrays['chi2']), meta['dof'],
+                   unwrap(arrays['iterations']), unwrap(arrays['converged']))
+
+    def save(self, filename):
+        """Saves the fitted parameters and statistics, not the model function (code
+        is never loaded from files); reopen it with `proxy_io.load_proxy`."""
+        save_proxy(filename, self)
+
+def _evaluate(model, x, params):
+    """Model values, shape (K, N), for the (K, p) params."""
+    return model(x, *(params.T[:, :, None]))
+
+def _jacobian(model, x, params, values, jacobian, lower, upper):
+    """Jacobian of the model, shape (K, N, p): analytic, or forward differences."""
+    K, p = params.shape
+    if jacobian is not None:
+        columns = jacobian(x, *(params.T[:, :, None]))
+        return np.stack([np.broadcast_to(column, values.shape) for column in columns], axis=-1)
+    J = np.empty(values.shape + (p,))
+    for j in range(p):
+        step = np.sqrt(np.finfo(float).eps)*np.maximum(np.abs(params[:, j]), 1)
+        # Step backwards when forwards would leave the bounds
+        step = np.where(params[:, j] + step > upper[j], -step, step)
+        shifted = params.copy()
+        shifted[:, j] += step
+        J[..., j] = (_evaluate(model, x, shifted) - values)/step[:, None]
+    return J
+
+def _qr(J, r):
+    """R and Q^T r of the QR decompositions of the (K, M, p) J, batched."""
+    K, _, p = J.shape
+    R, qtr = np.zeros((K, p, p)), np.zeros((K, p))
+    householder_fold(R, qtr, J, r)
+    return R, qtr
+
+def levenberg_marquardt(model, x, y, p0, jacobian=None, weights=None, bounds=None,
+                        absolute_weights : bool = False, tol : float = 1e-10, max_iter : int = 200):
+    """Fits `model(x, *params)` to y by Levenberg-Marquardt.
+
+    For one curve, y has shape (N,) and p0 shape (p,); for a batch of
+    K independent curves of the same model, y is (K, N) and p0 is
+    (p,) (shared start) or (K, p). x is shared, shape (N,), or (K, N).
+    `jacobian(x, *params)` returns the p derivatives of the model
+    (each broadcasting to the shape of y); without it, forward
+    differences are used, p extra model calls per iteration.
+    `weights` (as y) weigh the squared residuals (1/sigma^2 with
+    `absolute_weights`, otherwise relative, and the covariance is
+    scaled by chi2/dof as in `LinearRegression`).
+    `bounds` is a (lower, upper) pair of length p sequences (use
+    +-np.inf for none); parameters the fit pushes against a bound are
+    held there, and steps are projected onto the bounds.
+    Returns a `NonlinearFit`.
+    """
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    batch = y.ndim > 1
+    y = np.atleast_2d(y)
+    K, N = y.shape
+    params = np.array(np.broadcast_to(np.asarray(p0, float), (K, np.shape(p0)[-1])))
+    p = params.shape[1]
+    if N <= p:
+        raise ValueError('Need more points than parameters.')
+    root_weights = np.sqrt(np.broadcast_to(np.ones(N) if weights is None else np.asarray(weights, float), y.shape))
+    if bounds is None:
+        lower, upper = np.full(p, -np.inf), np.full(p, np.inf)
+    else:
+        lower, upper = (np.broadcast_to(np.asarray(bound, float), (p,)) for bound in bounds)
+        if np.any(lower > upper):
+            raise ValueError('Lower bounds above upper bounds.')
+    params = np.clip(params, lower, upper)
+
+    values = _evaluate(model, x, params)
+    residuals = root_weights*(y - values)
+    cost = np.sum(residuals**2, axis=1)
+    damping = np.full(K, 1e-3)
+    active = np.ones(K, bool)
+    converged = np.zeros(K, bool)
+    iterations = np.zeros(K, int)
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+        curves = np.flatnonzero(active)
+        J = root_weights[curves, :, None]*_jacobian(
+            model, x if x.ndim == 1 else x[curves], params[curves], values[curves], jacobian, lower, upper)
+        # Parameters at a bound the descent direction J^T r points past are
+        #  held there (a zero column gives a zero step), the rest move freely
+        gradient = np.einsum('kni,kn->ki', J, residuals[curves])
+        held = (((params[curves] <= lower) & (gradient < 0)) |
+                ((params[curves] >= upper) & (gradient > 0)))
+        J[held[:, None, :].repeat(J.shape[1], axis=1)] = 0
+        # Marquardt scaling, D = diag(J^T J): the squared column norms of J
+        scale = np.sum(J**2, axis=1)
+        scale[scale == 0] = 1 # (zero columns, which get zero steps)
+        damped = np.concatenate((J, np.sqrt(damping[curves, None]*scale)[:, None, :]*np.identity(p)), axis=1)
+        R, qtr = _qr(damped, np.concatenate((residuals[curves], np.zeros((len(curves), p))), axis=1))
+        step = upper_solve(R, qtr)
+        trial = np.clip(params[curves] + step, lower, upper)
+        # Overshooting steps may overflow; they are rejected below
+        with np.errstate(over='ignore', invalid='ignore'):
+            trial_values = _evaluate(model, x if x.ndim == 1 else x[curves], trial)
+            trial_residuals = root_weights[curves]*(y[curves] - trial_values)
+            trial_cost = np.sum(trial_residuals**2, axis=1)
+        iterations[curves] += 1
+        # Accept improving steps (relaxing the damping), reject the rest
+        accept = np.isfinite(trial_cost) & (trial_cost <= cost[curves])
+        taken = curves[accept]
+        small_change = (cost[taken] - trial_cost[accept] <= tol*cost[taken]) | np.all(
+            np.abs(trial[accept] - params[taken]) <= tol*(np.abs(params[taken]) + tol), axis=1)
+        params[taken] = trial[accept]
+        values[taken] = trial_values[accept]
+        residuals[taken] = trial_residuals[accept]
+        cost[taken] = trial_cost[accept]
+        damping[taken] = np.maximum(damping[taken]/10, 1e-12)
+        rejected = curves[~accept]
+        damping[rejected] *= 10
+        # A curve stops once its steps stop changing anything
+        done = taken[small_change]
+        converged[done] = True
+        active[done] = False
+        active[rejected[damping[rejected] > 1e16]] = False
+
+    # Covariance from the final Jacobian, (J^T J)^-1 = R^-1 R^-T
+    J = root_weights[:, :, None]*_jacobian(model, x, params, values, jacobian, lower, upper)
+    R, _ = _qr(J, np.zeros((K, N)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R_inverse = upper_solve(R, np.broadcast_to(np.identity(p), (K, p, p)))
+    covariance = R_inverse @ np.swapaxes(R_inverse, 1, 2)
+    dof = N - p
+    if not absolute_weights:
+        covariance = covariance*(cost/dof)[:, None, None]
+    if not batch:
+        return NonlinearFit(model, params[0], covariance[0], cost[0], dof, iterations[0], converged[0])
+    return NonlinearFit(model, params, covariance, cost, dof, iterations, converged)
+
+if __name__ == '__main__':
+    import time
+
+    # Radioactive decay counts (as in Folha12Ex1), A e^(-k t)
+    decay = lambda t, A, k: A*np.exp(-k*t)
+    decay_jacobian = lambda t, A, k: (np.exp(-k*t), -A*t*np.exp(-k*t))
+    t = np.arange(100.0)
+    counts = np.random.poisson(decay(t, 100000, 0.1)).astype(float)
+    fit = levenberg_marquardt(decay, t, counts, (1000, 1), decay_jacobian,
+        weights=1/np.maximum(counts, 1), absolute_weights=True)
+    print('Decay: A, k =', fit.error_values(), 'in {} iterations'.format(fit.iterations))
+
+    # Damped oscillation, with k >= 0 and the frequency bounded
+    oscillation = lambda t, A, k, w, phi: A*np.exp(-k*t)*np.cos(w*t + phi)
+    t = np.linspace(0, 10, 400)
+    y = oscillation(t, 2.0, 0.3, 3.0, 0.5) + 0.05*np.random.standard_normal(len(t))
+    fit = levenberg_marquardt(oscillation, t, y, (1, 0.1, 2.8, 0), bounds=((0, 0, 2, -np.pi), (10, 5, 4, np.pi)))
+    print('Oscillation: A, k, w, phi =', fit.error_values())
+
+    # Many curves of the same model at once
+    K = 10000
+    true = np.column_stack((np.random.uniform(1, 3, K), np.random.uniform(0.1, 0.5, K),
+                            np.random.uniform(2.5, 3.5, K), np.random.uniform(-1, 1, K)))
+    t = np.linspace(0, 10, 200)
+    y = oscillation(t, *(true.T[:, :, None])) + 0.05*np.random.standard_normal((K, len(t)))
+    start = time.perf_counter()
+    fit = levenberg_marquardt(oscillation, t, y, true*np.random.uniform(0.9, 1.1, (K, 4)),
+        bounds=((0, 0, 2, -np.pi), (10, 5, 4, np.pi)))
+    print('Batch of {} oscillations: {:.3f}s, {} converged, median |error| of w {:.2E}'.format(
+        K, time.perf_counter() - start, np.count_nonzero(fit.converged),
+        np.median(np.abs(fit.params[:, 2] - true[:, 2]))))
@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+
+"""On-disk format for fitted interpolants and fits ("proxies").
+
+A proxy is saved as an uncompressed .npz archive holding its arrays
+plus a `__meta__` entry (a JSON string) with the format version,
+the class that wrote it and any extra metadata.
+
+Because the archive is not compressed, every array can be opened
+as a read-only np.memmap straight from the file: loading only reads
+the archive index and array headers, and worker processes that
+load the same file share its pages through the OS cache.
+
+Classes that want to be saved implement
+    `proxy_arrays(self) -> dict` of name -> np.array,
+    `proxy_meta(self) -> dict` (optional) of JSON-serializable values,
+    `from_proxy(cls, arrays, meta)` classmethod rebuilding the object,
+and are registered with the `register_proxy` decorator. Loading only
+ever rebuilds registered classes, so a crafted file cannot make it
+import or call anything else; the modules in PROXY_MODULES are
+imported on demand, others must be imported before loading.
+"""
+
+import os
+import sys
+import json
+import struct
+import zipfile
+import importlib
+import numpy as np
+
+FORMAT_VERSION = 1
+META_KEY = '__meta__'
+# Modules defining proxy classes, imported by `load_proxy` when needed
+PROXY_MODULES = ('Folha5Ex1', 'Folha5Ex3', 'Folha9Ex1', 'grid_interpolation',
+    'least_squares', 'nonlinear_fit')
+
+_registry = {} # (module, class name) -> class
+
+def _class_path(cls):
+    module = cls.__module__
+    if module == '__main__':
+        # Defined in a script being run; it is importable by its file name
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+    return module, cls.__qualname__
+
+def register_proxy(cls):
+    """Class decorator allowing `load_proxy` to rebuild instances of `cls`."""
+    _registry[_class_path(cls)] = cls
+    return cls
+
+def save_proxy(filename, proxy):
+    """Saves `proxy` to `filename` (an .npz archive)."""
+    if _class_path(type(proxy)) not in _registry:
+        raise ValueError('{} is not registered with register_proxy.'.format(type(proxy).__qualname__))
+    # Arrays are streamed into the archive as they are (np.lib.format writes
+    # them in buffered chunks), so memory-mapped tables are never read whole
+    arrays = {name: np.asarray(array) for name, array in proxy.proxy_arrays().items()}
+    if META_KEY in arrays:
+        raise ValueError('"{}" is a reserved array name.'.format(META_KEY))
+    module, name = _class_path(type(proxy))
+    meta = {
+        'version': FORMAT_VERSION,
+        'module': module,
+        'class': name,
+        'meta': proxy.proxy_meta() if hasattr(proxy, 'proxy_meta') else {},
+    }
+    arrays[META_KEY] = np.array(json.dumps(meta))
+    with open(filename, 'wb') as file:
+        np.savez(file, **arrays)
+
+def _open_member(filename, file, info):
+    """Returns the archive member described by `info` as a read-only memmap."""
+    file.seek(info.header_offset)
+    local_header = file.read(30)
+    name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+    file.seek(info.header_offset + 30 + name_len + extra_len)
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    if dtype.hasobject:
+        raise ValueError('Refusing to load object arrays from {}.'.format(filename))
+    if 0 in shape:
+        return np.empty(shape, dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=file.tell(),
+        shape=shape, order='F' if fortran_order else 'C')
+
+def read_proxy(filename):
+    """Returns the (arrays, meta) pair stored in `filename`.
+
+    `meta` is the full metadata record (version, module, class, meta).
+    Arrays are read-only memmaps; nothing is read until they are used.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                # Someone recompressed the archive; no mapping possible
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+            else:
+                arrays[name] = _open_member(filename, file, info)
+    if META_KEY not in arrays:
+        raise ValueError('{} is not a saved proxy.'.format(filename))
+    meta = json.loads(str(arrays.pop(META_KEY)[()]))
+    if meta['version'] > FORMAT_VERSION:
+        raise ValueError('{} was written by a newer format version ({} > {}).'.format(
+            filename, meta['version'], FORMAT_VERSION))
+    return arrays, meta
+
+def load_proxy(filename):
+    """Loads whatever proxy object was saved to `filename`."""
+    arrays, meta = read_proxy(filename)
+    key = (meta['module'], meta['class'])
+    if key not in _registry and meta['module'] in PROXY_MODULES:
+        importlib.import_module(meta['module'])
+    if key not in _registry:
+        raise ValueError('{} holds a {}.{}, which is not a registered proxy class.'.format(filename, *key))
+    return _registry[key].from_proxy(arrays, meta['meta'])
+
+if __name__ == '__main__':
+    import tempfile
+    # The classes register with the imported proxy_io, not this script
+    from proxy_io import load_proxy
+    from Folha5Ex3 import get_spline_interpolation
+    from Folha9Ex1 import PolynomialFit
+
+    x = np.linspace(0, 10, 10**6)
+    spline = get_spline_interpolation(tuple(zip(x[::1000], np.sin(x[::1000]))))
+    fit = PolynomialFit.fit(x, np.cos(x), 5)
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, proxy in (('spline.npz', spline), ('fit.npz', fit)):
+            filename = os.path.join(folder, name)
+            proxy.save(filename)
+            loaded = load_proxy(filename)
+            print(name, type(loaded).__name__, 'max. difference:', np.max(np.abs(loaded(x) - proxy(x))))
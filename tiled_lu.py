@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*-
+
+"""Out-of-core LU factorization, for matrices larger than memory.
+
+The matrix is a square .npy file (float64), memory-mapped and
+factored in place: `TiledLUFactorization` reads it one panel of
+`tile_size` columns at a time and streams the previous factors past
+it in tiles of `tile_size` lines, so only about
+    (n + 2*tile_size) * tile_size
+numbers are resident at once. Store the file in Fortran order
+(`np.lib.format.open_memmap(..., fortran_order=True)`) so each panel
+is a contiguous read.
+
+Lines are never swapped on disk: line i of the factors (as in
+Folha7Ex2.LUFactorization, `matrix[perm] = L @ U`) stays in line
+perm[i] of the file. The permutation is saved next to the matrix, in
+'<name>.perm.npy', so the factors can be reopened with
+`TiledLUFactorization.load`.
+"""
+
+import os
+import numpy as np
+from Folha7Ex2 import Permutation
+
+def _perm_filename(filename):
+    root, _ = os.path.splitext(filename)
+    return root + '.perm.npy'
+
+def _unit_lower_solve(L, B):
+    """Solves  L X = B  in place, L unit lower triangular (a tile)."""
+    for i in range(1, len(L)):
+        B[i] -= L[i, :i] @ B[:i]
+    return B
+
+def _upper_solve(U, B):
+    """Solves  U X = B  in place, U upper triangular (a tile)."""
+    for i in range(len(U) - 1, -1, -1):
+        B[i] = (B[i] - U[i, i+1:] @ B[i+1:])/U[i, i]
+    return B
+
+class TiledLUFactorization:
+    """LU decomposition with partial pivoting of a memory-mapped .npy matrix.
+
+    The file is overwritten by the factors (left looking: each panel
+    gets the updates from all the panels on its left, is factored in
+    memory, and is written back once). Solves read the factors tile
+    by tile, too.
+    """
+    def __init__(self, filename, tile_size : int = 1024, factor : bool = True):
+        self.filename = filename
+        self.matrix = np.load(filename, mmap_mode='r+')
+        n, m = self.matrix.shape
+        if n != m:
+            raise ValueError("Cannot LU non square matrix!")
+        self.n = n
+        self.tile_size = tile_size
+        self.perm = np.arange(n)
+        if factor:
+            self._factor()
+            np.save(_perm_filename(filename), self.perm)
+
+    @classmethod
+    def load(cls, filename, tile_size : int = 1024):
+        """Reopens factors computed earlier (the file and its .perm.npy)."""
+        factorization = cls(filename, tile_size, factor=False)
+        factorization.perm = np.load(_perm_filename(filename))
+        return factorization
+
+    @property
+    def permutation(self):
+        return Permutation(self.perm)
+
+    def _tiles(self, start, stop):
+        """(i0, i1) bounds of the line tiles covering start:stop."""
+        return ((i0, min(i0 + self.tile_size, stop)) for i0 in range(start, stop, self.tile_size))
+
+    def _factor(self):
+        matrix, perm, n = self.matrix, self.perm, self.n
+        for j0, j1 in self._tiles(0, n):
+            # Panel, lines in pivoted order
+            panel = np.array(matrix[:, j0:j1], float)[perm]
+            # Updates from the factored panels on the left
+            for k0, k1 in self._tiles(0, j0):
+                L = np.array(matrix[perm[k0:k1], k0:k1])
+                _unit_lower_solve(L, panel[k0:k1])
+                for i0, i1 in self._tiles(k1, n):
+                    panel[i0:i1] -= matrix[perm[i0:i1], k0:k1] @ panel[k0:k1]
+            # Factor the panel (its lines j0:)
+            for j in range(j1 - j0):
+                line = j0 + j
+                pivot = line + np.argmax(np.abs(panel[line:, j]))
+                if pivot != line:
+                    panel[[line, pivot]] = panel[[pivot, line]]
+                    perm[[line, pivot]] = perm[[pivot, line]]
+                if panel[line, j] == 0:
+                    continue # Singular; nothing left to eliminate in this column
+                panel[line+1:, j] /= panel[line, j]
+                panel[line+1:, j+1:] -= np.outer(panel[line+1:, j], panel[line, j+1:])
+            matrix[perm, j0:j1] = panel
+        matrix.flush()
+
+    def solve(self, b):
+        """Solves  Ax = b  for x; b is a vector, shape (n,), or a block, shape (n, m)."""
+        matrix, perm, n = self.matrix, self.perm, self.n
+        x = np.array(b, float)[perm]
+        # Forward substitution, one panel of L at a time
+        for k0, k1 in self._tiles(0, n):
+            _unit_lower_solve(np.array(matrix[perm[k0:k1], k0:k1]), x[k0:k1])
+            for i0, i1 in self._tiles(k1, n):
+                x[i0:i1] -= matrix[perm[i0:i1], k0:k1] @ x[k0:k1]
+        # Back substitution, one panel of U at a time
+        for k0, k1 in reversed(tuple(self._tiles(0, n))):
+            _upper_solve(np.array(matrix[perm[k0:k1], k0:k1]), x[k0:k1])
+            for i0, i1 in self._tiles(0, k0):
+                x[i0:i1] -= matrix[perm[i0:i1], k0:k1] @ x[k0:k1]
+        return x
+
+    def slogdet(self):
+        """Returns (sign, log|det A|), as Folha7Ex2.LUFactorization.slogdet."""
+        diagonal = np.asarray(self.matrix[self.perm, np.arange(self.n)])
+        if np.any(diagonal == 0):
+            return 0.0, -np.inf
+        sign = self.permutation.sign*(-1)**np.count_nonzero(diagonal < 0)
+        return float(sign), float(np.sum(np.log(np.abs(diagonal))))
+
+if __name__ == '__main__':
+    import time
+    import tempfile
+
+    n, tile_size = 4000, 500
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'matrix.npy')
+        matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=float, shape=(n, n), fortran_order=True)
+        for i0 in range(0, n, tile_size):
+            matrix[i0:i0 + tile_size] = np.random.default_rng(i0).random((min(tile_size, n - i0), n))
+        original = np.array(matrix)
+        matrix.flush()
+        del matrix
+        b = np.random.random(n)
+
+        start = time.perf_counter()
+        factorization = TiledLUFactorization(filename, tile_size)
+        factored = time.perf_counter()
+        x = factorization.solve(b)
+        print('Tiled LU, n={}, tiles of {}: factor {:.3f}s, solve {:.3f}s, residual {:.2E}'.format(
+            n, tile_size, factored - start, time.perf_counter() - factored,
+            np.max(np.abs(original @ x - b))))
+        print('log|det A|: {:.6f} (numpy: {:.6f})'.format(
+            factorization.slogdet()[1], np.linalg.slogdet(original)[1]))
+        del factorization